@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+"""
+Packed binary archives of puzzles (and their solutions)
+
+A header, then fixed size records, each holding one grid per field (the
+puzzle, or the puzzle then its solution).  A grid is its cells in reading
+order, either two per byte ("nibble", 41 bytes for 9x9) or one per byte
+("byte", 81 bytes, readable as an (N, fields, 9, 9) uint8 array in place).
+A puzzle that wasn't solved gets an all zero solution, which no real
+solution can be, so record i still goes with line i of the input.
+Records being one size, record i is at HEADER.size + i * record size, so
+that arithmetic is the index and any record is one slice of the mapped
+file away, however many there are.
+
+    ./archive.py pack corpora/*.txt --solve -o all.sdka
+    ./archive.py sample all.sdka -n 5 --field 1
+"""
+
+import sys
+import json
+import mmap
+import random
+import struct
+import logging
+import argparse
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'SDKA'
+VERSION = 1
+# magic, version, box, fields, encoding, record count
+HEADER = struct.Struct('<4sBBBBQ')
+ENCODINGS = ("nibble", "byte")
+
+# packed byte -> its high / low cell
+_HIGH = bytes(b >> 4 for b in range(256))
+_LOW = bytes(b & 15 for b in range(256))
+
+
+def grid_bytes(box, encoding):
+    cells = box**4
+    return (cells + 1) // 2 if encoding == "nibble" else cells
+
+
+def pack_grid(grid, encoding="nibble"):
+    flat = bytes(v for row in grid for v in row)
+    if encoding == "byte":
+        return flat
+    if len(flat) % 2:
+        flat += b'\0'
+    return bytes(hi << 4 | lo for hi, lo in zip(flat[0::2], flat[1::2]))
+
+
+def unpack_grid(data, box=3, encoding="nibble"):
+    size = box*box
+    if encoding == "nibble":
+        flat = bytearray(2*len(data))
+        flat[0::2] = data.translate(_HIGH)
+        flat[1::2] = data.translate(_LOW)
+    else:
+        flat = data
+    return [list(flat[row*size:(row + 1)*size]) for row in range(size)]
+
+
+class ArchiveWriter(object):
+    """ streams records to a new archive; the record count in the header
+        is filled in by close()
+
+        add() takes one grid per field, add_results() the (index, Result)
+        pairs of sudoku.solve_many()
+    """
+    def __init__(self, path, fields=1, encoding="nibble", box=3, bufsize=1 << 20):
+        if encoding not in ENCODINGS:
+            raise ValueError("encoding is one of {}, not {!r}".format(ENCODINGS, encoding))
+        if encoding == "nibble" and box > 3:
+            raise ValueError("a {0}x{0} grid doesn't fit in nibbles".format(box*box))
+        self.path = path
+        self.fields, self.encoding, self.box = fields, encoding, box
+        self.count = 0
+        self.unsolved = 0
+        self.out = open(path, 'wb', buffering=bufsize)
+        self.out.write(HEADER.pack(MAGIC, VERSION, box, fields, ENCODINGS.index(encoding), 0))
+
+    def add(self, *grids):
+        if len(grids) != self.fields:
+            raise ValueError("a record has {} grids, not {}".format(self.fields, len(grids)))
+        for grid in grids:
+            if len(grid) != self.box*self.box:
+                raise ValueError("a {0}x{0} archive can't hold a {1}x{1} grid".format(
+                    self.box*self.box, len(grid)))
+            self.out.write(pack_grid(grid, self.encoding))
+        self.count += 1
+
+    def add_results(self, results, puzzles=None):
+        """ write the solution of each (index, Result), after its puzzle in
+            a two field archive: puzzles is a dict of index -> puzzle whose
+            entries are dropped as they are written.  An unsolved Result is
+            written as an all zero grid and counted in self.unsolved
+        """
+        size = self.box*self.box
+        for index, result in results:
+            grid = result.grid
+            if not result.solved:
+                self.unsolved += 1
+                grid = [[0] * size for _ in range(size)]
+            if self.fields == 2:
+                self.add(puzzles.pop(index), grid)
+            else:
+                self.add(grid)
+
+    def close(self):
+        if self.out is None:
+            return
+        self.out.seek(0)
+        self.out.write(HEADER.pack(MAGIC, VERSION, self.box, self.fields,
+            ENCODINGS.index(self.encoding), self.count))
+        self.out.close()
+        self.out = None
+        log.info("%s records in %s", self.count, self.path)
+        if self.unsolved:
+            log.warning("%s of them unsolved, stored with all zero solutions",
+                    self.unsolved)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Archive(object):
+    """ an archive mapped read only: archive[i] decodes record i into a
+        tuple of grids, grids(start, stop) gives a range as an array
+
+        nothing is read until asked for, so the file can be far bigger
+        than memory.  Arrays from a "byte" archive are views onto the map
+        and are only valid until close()
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError("{} is too short for an archive".format(path))
+        magic, version, box, fields, encoding, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or encoding >= len(ENCODINGS):
+            raise ValueError("{} isn't a version {} archive".format(path, VERSION))
+        self.box, self.fields, self.encoding = box, fields, ENCODINGS[encoding]
+        self.grid_size = grid_bytes(box, self.encoding)
+        self.record_size = fields*self.grid_size
+        self.count = (len(self.map) - HEADER.size) // self.record_size
+        if count != self.count:
+            # a writer that never got to close() leaves a count of 0
+            log.warning("%s: header says %s records, the file holds %s",
+                    path, count, self.count)
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            log.info("%s still has arrays viewing it, leaving it mapped", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("record {} of {}".format(index, self.count))
+        start = HEADER.size + index*self.record_size
+        return tuple(unpack_grid(self.map[at:at + self.grid_size], self.box, self.encoding)
+                for at in range(start, start + self.record_size, self.grid_size))
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def sample(self, k, rng=None):
+        """ k records at distinct random indices """
+        rng = rng or random
+        return [self[index] for index in rng.sample(range(self.count), k)]
+
+    def raw(self, start=0, stop=None):
+        """ records start to stop as an (N, record size) uint8 array viewing
+            the map, packed as they are on disk
+        """
+        import numpy as np
+        stop = self.count if stop is None else min(stop, self.count)
+        start = min(start, stop)
+        return np.frombuffer(self.map, dtype=np.uint8, count=(stop - start)*self.record_size,
+                offset=HEADER.size + start*self.record_size).reshape(-1, self.record_size)
+
+    def grids(self, start=0, stop=None):
+        """ records start to stop as an (N, fields, size, size) uint8 array,
+            a view onto the map for "byte" archives and unpacked otherwise
+        """
+        import numpy as np
+        size = self.box*self.box
+        raw = self.raw(start, stop).reshape(-1, self.fields, self.grid_size)
+        if self.encoding == "nibble":
+            cells = np.empty(raw.shape[:2] + (2*self.grid_size,), dtype=np.uint8)
+            cells[..., 0::2] = raw >> 4
+            cells[..., 1::2] = raw & 15
+            raw = cells[..., :size*size]
+        return raw.reshape(-1, self.fields, size, size)
+
+
+def pack(puzzles, path, solve=False, encoding="nibble", engine="board", workers=1):
+    """ write puzzles to a new archive, with solve each followed by its
+        solution from sudoku.solve_many(); returns (records, unsolved)
+    """
+    with ArchiveWriter(path, 2 if solve else 1, encoding) as writer:
+        if not solve:
+            for grid in puzzles:
+                writer.add(grid)
+            return writer.count, 0
+        # solve_many only pulls a few chunks ahead, so only those are kept
+        pending = {}
+        def remember():
+            for index, grid in enumerate(puzzles):
+                pending[index] = grid
+                yield grid
+        writer.add_results(sudoku.solve_many(remember(), engine, workers), pending)
+        return writer.count, writer.unsolved
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Pack puzzle files into a "
+            "binary archive, or read puzzles back out of one")
+    parser.add_argument('command', choices=('pack', 'unpack', 'sample', 'info'))
+    parser.add_argument('files', nargs='+',
+            help="puzzle files to pack ('-' for stdin), or the archive to read")
+    parser.add_argument('-o', '--output', default='-',
+            help="archive to write / puzzle file to write, '-' for stdout")
+    parser.add_argument('--solve', action='store_true',
+            help="pack: store each solution after its puzzle")
+    parser.add_argument('--encoding', default='nibble', choices=ENCODINGS)
+    parser.add_argument('-e', '--engine', default='board', choices=sorted(sudoku.ENGINES))
+    parser.add_argument('-j', '--workers', type=int, default=1,
+            help="pack: solver processes, 0 for one per cpu")
+    parser.add_argument('--field', type=int, default=0,
+            help="unpack / sample: which grid of each record to write")
+    parser.add_argument('-n', '--count', type=int, default=10,
+            help="sample: how many records")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.command == 'pack':
+        if args.output == '-':
+            raise SystemExit("pack needs an archive to write, -o FILE")
+        _, unsolved = pack(sudoku.read_puzzles(args.files), args.output, args.solve,
+                args.encoding, args.engine, args.workers)
+        return 1 if unsolved else 0
+
+    with Archive(args.files[0]) as archive:
+        if args.command == 'info':
+            json.dump({"records": len(archive), "fields": archive.fields,
+                    "encoding": archive.encoding, "box": archive.box,
+                    "record_bytes": archive.record_size}, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+            return 0
+        if args.command == 'sample':
+            records = archive.sample(min(args.count, len(archive)), random.Random(args.seed))
+        else:
+            records = iter(archive)
+        out = sys.stdout if args.output == '-' else open(args.output, 'w')
+        try:
+            for record in records:
+                grid = record[args.field]
+                # '-' for the all zero solution of an unsolved puzzle
+                blank = args.field and not any(v for row in grid for v in row)
+                out.write(('-' if blank else sudoku.format_grid(grid)) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""
+Benchmark the sudoku solver engines
+
+Puzzles come from the tiered corpora in corpora/*.txt (one 81 character
+puzzle per line, see sudoku.read_puzzles), small tiers padded out with
+shuffled copies so p99 is more than the slowest puzzle.  For every engine
+and tier the report has throughput, p50 / p99 latency, solve rate, peak
+traced memory and the per technique counters, as json.  Latencies are
+each puzzle's best over --repeat timed rounds after an untimed warm up.
+Given a saved report as a baseline, any metric that got worse by more than
+the tolerance is flagged and the exit status is non zero.
+
+    ./bench.py -o baseline.json
+    ./bench.py --baseline baseline.json
+    ./bench.py generate     # rebuild corpora/generated.txt with generator.py
+    ./bench.py scaling      # solve time against grid size, 4x4 to 25x25
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import tracemalloc
+
+import sudoku
+import generator
+
+log = logging.getLogger(__name__)
+
+CORPORA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpora")
+TIERS = ("easy", "hard", "minimal17", "generated")
+MIN_TIER = 100      # puzzles per tier, the hand picked ones padded out
+
+# metric -> (True when bigger is better, its share of the tolerance): p99
+# is the next to slowest of 100 puzzles and wanders more than the rest
+_METRICS = {
+        "throughput": (True, 1),
+        "solve_rate": (True, 1),
+        "p50_ms": (False, 1),
+        "p99_ms": (False, 2),
+        "peak_kb": (False, 1),
+        }
+
+
+def load_tier(tier, size=MIN_TIER):
+    """ the tier's puzzles, then shuffled copies of them (the same every
+        run) up to size
+    """
+    puzzles = list(sudoku.read_puzzles([os.path.join(CORPORA, tier + ".txt")]))
+    originals = puzzles[:]
+    rng = random.Random(tier)
+    while originals and len(puzzles) < size:
+        puzzles.append(shuffle_grid(rng.choice(originals), rng))
+    return puzzles
+
+
+def shuffle_grid(grid, rng):
+    """ an equivalent puzzle: digits relabelled, rows shuffled within bands,
+        bands shuffled, the same for columns, and maybe transposed
+    """
+    digits = list(range(1, 10))
+    rng.shuffle(digits)
+    def order():
+        bands = rng.sample(range(3), 3)
+        return [band*3 + i for band in bands for i in rng.sample(range(3), 3)]
+    rows, cols = order(), order()
+    out = [[grid[r][c] and digits[grid[r][c] - 1] for c in cols] for r in rows]
+    if rng.random() < 0.5:
+        out = [list(col) for col in zip(*out)]
+    return out
+
+
+def make_sized(box, count=10, seed=1, clues=0.5):
+    """ puzzles on a box**2 board: a shuffled pattern solution with about
+        clues (a fraction) of its cells left in, not checked for uniqueness
+    """
+    rng = random.Random(seed)
+    size = box*box
+    puzzles = []
+    for _ in range(count):
+        digits = rng.sample(range(1, size + 1), size)
+        def order():
+            bands = rng.sample(range(box), box)
+            return [band*box + i for band in bands for i in rng.sample(range(box), box)]
+        rows, cols = order(), order()
+        puzzles.append([[digits[(box*(r % box) + r // box + c) % size]
+                if rng.random() < clues else 0 for c in cols] for r in rows])
+    return puzzles
+
+
+def make_generated(count=200, seed=1, workers=1):
+    """ minimal unique puzzles from generator.py, reproducible from seed """
+    return list(generator.generate_many(count, seed, workers))
+
+
+def _percentile(ordered, pct):
+    """ nearest rank percentile of a sorted list """
+    if not ordered:
+        return 0.0
+    rank = math.ceil(pct/100*len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def _timed_pass(engine, puzzles, best):
+    """ solve each puzzle once, lowering best[n] to its time if quicker """
+    for n, grid in enumerate(puzzles):
+        start = time.perf_counter()
+        sudoku.solve(grid, engine)
+        best[n] = min(best[n], time.perf_counter() - start)
+
+
+def bench_tier(engine, puzzles, latencies, solved):
+    """ the report for one engine on one tier from each puzzle's best time;
+        memory is traced and techniques counted in a separate,
+        instrumented pass so neither skews the latencies
+    """
+    stats = sudoku.Stats()
+    tracemalloc.start()
+    try:
+        for grid in puzzles:
+            stats.add(sudoku.solve(grid, engine, instrument=True))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    techniques = {}
+    for name, counts in stats.techniques.items():
+        counts = dict(counts)
+        seconds = counts.get("seconds", 0)
+        counts["passes_per_sec"] = counts.get("passes", 0)/seconds if seconds else 0.0
+        techniques[name] = counts
+    return {
+            "puzzles": len(latencies),
+            "solved": solved,
+            "solve_rate": solved/len(latencies) if latencies else 0.0,
+            "throughput": len(latencies)/total if total else 0.0,
+            "p50_ms": 1000*_percentile(latencies, 50),
+            "p99_ms": 1000*_percentile(latencies, 99),
+            "peak_kb": peak/1024,
+            "nodes": stats.nodes,
+            "techniques": techniques,
+            }
+
+
+def run(engines, tiers, repeat=5):
+    """ one untimed warm up pass per engine and tier (which also counts the
+        solves), then repeat timed rounds over all of them keeping each
+        puzzle's best time
+
+        the rounds go engine by tier in turn rather than repeating one tier
+        back to back, so a slow spell of the machine (seconds long on a
+        shared host) costs a puzzle one sample, not all of them
+    """
+    corpora = {tier: load_tier(tier) for tier in tiers}
+    pairs = [(engine, tier) for engine in engines for tier in tiers]
+    solved = {}
+    best = {}
+    for engine, tier in pairs:
+        puzzles = corpora[tier]
+        log.info("%s on %s: %s puzzles", engine, tier, len(puzzles))
+        solved[engine, tier] = sum(bool(sudoku.solve(grid, engine).solved) for grid in puzzles)
+        best[engine, tier] = [math.inf] * len(puzzles)
+    for n in range(repeat):
+        log.info("Timed round %s of %s", n + 1, repeat)
+        for engine, tier in pairs:
+            _timed_pass(engine, corpora[tier], best[engine, tier])
+    results = {}
+    for engine, tier in pairs:
+        results.setdefault(engine, {})[tier] = bench_tier(engine, corpora[tier],
+                best[engine, tier], solved[engine, tier])
+    return {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "results": results,
+            }
+
+
+def compare(report, baseline, tolerance=0.25):
+    """ list (engine, tier, metric, old, new) for metrics that got worse
+        by more than tolerance (a fraction, twice that for p99) compared
+        to baseline
+    """
+    regressions = []
+    for engine, tiers in report["results"].items():
+        for tier, metrics in tiers.items():
+            old_metrics = baseline.get("results", {}).get(engine, {}).get(tier)
+            if old_metrics is None:
+                continue
+            for metric, (bigger_is_better, share) in _METRICS.items():
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old)/old
+                if (-change if bigger_is_better else change) > share*tolerance:
+                    regressions.append((engine, tier, metric, old, new))
+    return regressions
+
+
+def bench_scaling(engines, boxes, count=5, seed=1, clues=0.5):
+    """ mean / p50 / max solve time and mean search nodes for random
+        puzzles on each box**2 board size
+    """
+    results = {}
+    for box in boxes:
+        puzzles = make_sized(box, count, seed, clues)
+        for engine in engines:
+            latencies = []
+            nodes = solved = 0
+            for grid in puzzles:
+                start = time.perf_counter()
+                result = sudoku.solve(grid, engine)
+                latencies.append(time.perf_counter() - start)
+                nodes += result.nodes
+                solved += bool(result.solved)
+            latencies.sort()
+            log.info("%s on %sx%s: %.4gs mean", engine, box*box, box*box,
+                sum(latencies)/count)
+            results.setdefault(engine, {})["{0}x{0}".format(box*box)] = {
+                    "puzzles": count,
+                    "solved": solved,
+                    "mean_ms": 1000*sum(latencies)/count,
+                    "p50_ms": 1000*_percentile(latencies, 50),
+                    "max_ms": 1000*latencies[-1],
+                    "nodes": nodes/count,
+                    }
+    return {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "clues": clues,
+            "seed": seed,
+            "results": results,
+            }
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the sudoku engines "
+            "over the corpora, optionally against a saved baseline report")
+    parser.add_argument('command', nargs='?', default='run',
+            choices=('run', 'generate', 'scaling'))
+    parser.add_argument('-e', '--engine', action='append', choices=sorted(sudoku.ENGINES),
+            help="engine to run, repeat for several (default all)")
+    parser.add_argument('-t', '--tier', action='append', choices=TIERS,
+            help="corpus to run, repeat for several (default all)")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+            help="timed passes over each corpus, each puzzle keeps its best")
+    parser.add_argument('-o', '--output', default='-',
+            help="json report file, '-' for stdout")
+    parser.add_argument('-b', '--baseline', help="report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+            help="allowed fractional slowdown before flagging, doubled for "
+            "p99 (default 0.25)")
+    parser.add_argument('--count', type=int, default=200,
+            help="puzzles to generate")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-j', '--workers', type=int, default=1,
+            help="generate: processes, 0 for one per cpu")
+    parser.add_argument('--box', type=int, action='append',
+            help="scaling: box size to run, repeat for several (default 2 to 5)")
+    parser.add_argument('--per-size', type=int, default=5,
+            help="scaling: puzzles per board size")
+    parser.add_argument('--clues', type=float, default=0.5,
+            help="scaling: fraction of cells given")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.command == 'generate':
+        path = os.path.join(CORPORA, "generated.txt")
+        with open(path, 'w') as f:
+            f.write("# generated: minimal unique puzzles from generator.py,\n"
+                    "# ./bench.py generate --count {} --seed {}\n".format(args.count, args.seed))
+            for grid in make_generated(args.count, args.seed, args.workers):
+                f.write(sudoku.format_grid(grid) + '\n')
+        return 0
+
+    engines = args.engine or sorted(sudoku.ENGINES)
+    if args.command == 'scaling':
+        report = bench_scaling(engines, args.box or (2, 3, 4, 5), args.per_size,
+                args.seed, args.clues)
+    else:
+        report = run(engines, args.tier or TIERS, args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for engine, tier, metric, old, new in regressions:
+            log.warning("REGRESSION %s/%s %s: %.4g -> %.4g", engine, tier, metric, old, new)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+"""
+Generate sudoku puzzles with a unique solution
+
+A random complete grid comes from the propagating search with its value
+order shuffled, then clues are taken away (a symmetric orbit of cells at a
+time) as long as the puzzle stays unique.  Without a target clue count the
+result is minimal: putting back any removed orbit is needed, taking away
+any kept one is not allowed.
+
+    ./generator.py -n 1000 --seed 7 -j 0 --symmetry rotational -o fresh.txt
+"""
+
+import os
+import sys
+import random
+import logging
+import argparse
+import collections
+import concurrent.futures
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+# cells that are given or blanked together, as (row, col) -> [(row, col), ...]
+SYMMETRIES = {
+        "none": lambda r, c, n: [(r, c)],
+        "rotational": lambda r, c, n: [(r, c), (n - 1 - r, n - 1 - c)],
+        "mirror": lambda r, c, n: [(r, c), (r, n - 1 - c)],
+        "diagonal": lambda r, c, n: [(r, c), (c, r)],
+        "quarter": lambda r, c, n: [(r, c), (c, n - 1 - r), (n - 1 - r, n - 1 - c),
+            (n - 1 - c, r)],
+        }
+
+
+def _orbits(topo, symmetry):
+    """ the cells grouped into the sets symmetry keeps together """
+    n = topo.size
+    seen = set()
+    orbits = []
+    for pos in topo.cells:
+        if pos in seen:
+            continue
+        orbit = sorted({r*n + c for r, c in SYMMETRIES[symmetry](pos // n, pos % n, n)})
+        seen.update(orbit)
+        orbits.append(orbit)
+    return orbits
+
+
+def random_grid(rng, box=3):
+    """ a complete grid, random by way of rng """
+    size = box*box
+    board = sudoku.Board([[0] * size for _ in range(size)])
+    if not board.search(rng):
+        raise RuntimeError("no complete grid, the search is broken")
+    return board.export()
+
+
+def _has_other(board, pos, val):
+    """ True when the board has a solution with pos not val, leaves the
+        board as it found it
+        """
+    mark = (len(board.trail), board.uncertainty)
+    try:
+        return board.eliminate(pos, val) and board.search()
+    finally:
+        board.undo(mark)
+
+
+def reduce_grid(solution, rng, target=None, symmetry="none"):
+    """ blank out clues of a complete grid while its solution stays unique,
+        stopping early once target clues (if given) are left
+
+        one board is kept for the whole run: clues found to be needed are
+        assigned into it for good, so their propagation is shared by every
+        later check, and each check only adds the clues still undecided and
+        rolls them back after.  A puzzle that was unique with the orbit
+        given is still unique without it when no solution differs from the
+        known one on the orbit
+    """
+    topo = sudoku.topology_of(solution)
+    size = topo.size
+    values = [v for row in solution for v in row]
+    board = sudoku.Board([[0] * size for _ in range(size)])
+    board.trail = []
+    orbits = _orbits(topo, symmetry)
+    rng.shuffle(orbits)
+    kept = []
+    for n, orbit in enumerate(orbits):
+        rest = [p for later in orbits[n + 1:] for p in later]
+        if target is not None and len(kept) + len(orbit) + len(rest) <= target:
+            kept.extend(p for later in orbits[n:] for p in later)
+            break
+        mark = (len(board.trail), board.uncertainty)
+        for p in rest:
+            board.assign(p, values[p])
+        unique = not any(_has_other(board, p, values[p]) for p in orbit)
+        board.undo(mark)
+        if not unique:
+            kept.extend(orbit)
+            for p in orbit:
+                board.assign(p, values[p])
+
+    puzzle = [[0] * size for _ in range(size)]
+    for p in kept:
+        puzzle[p // size][p % size] = values[p]
+    return puzzle
+
+
+def make_puzzle(rng, target=None, symmetry="none", attempts=1, box=3):
+    """ a unique puzzle, the fewest clues over attempts fresh grids, stopping
+        as soon as one gets down to target
+    """
+    best = best_clues = None
+    for _ in range(attempts):
+        puzzle = reduce_grid(random_grid(rng, box), rng, target, symmetry)
+        clues = sum(1 for row in puzzle for v in row if v)
+        if best is None or clues < best_clues:
+            best, best_clues = puzzle, clues
+        if target is not None and clues <= target:
+            break
+    log.debug("Puzzle with %s clues", best_clues)
+    return best
+
+
+def _make_nth(seed, index, target, symmetry, attempts, box):
+    """ puzzle number index of a seeded run, the same whichever worker
+        makes it
+    """
+    rng = random.Random("{}:{}".format(seed, index))
+    return make_puzzle(rng, target, symmetry, attempts, box)
+
+
+def generate_many(count, seed=None, workers=None, target=None, symmetry="none",
+        attempts=1, box=3):
+    """ yield count puzzles in order, made over a process pool
+
+        the output depends only on seed (random when None), not on the
+        number of workers; at most 2 puzzles per worker are in flight
+    """
+    if seed is None:
+        seed = random.randrange(1 << 32)
+        log.info("Generating with seed %s", seed)
+    args = (target, symmetry, attempts, box)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for index in range(count):
+            yield _make_nth(seed, index, *args)
+        return
+
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        pending = collections.deque()
+        for index in range(count):
+            pending.append(pool.submit(_make_nth, seed, index, *args))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Generate sudoku puzzles with "
+            "a unique solution, one per line as 81 characters")
+    parser.add_argument('-n', '--count', type=int, default=10)
+    parser.add_argument('--seed', type=int, help="repeat a run (default random)")
+    parser.add_argument('--clues', type=int,
+            help="stop taking clues away at this many (default minimal)")
+    parser.add_argument('--symmetry', default='none', choices=sorted(SYMMETRIES))
+    parser.add_argument('--attempts', type=int, default=1,
+            help="grids to try per puzzle when --clues isn't reached")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+            help="processes, 0 for one per cpu")
+    parser.add_argument('-o', '--output', default='-',
+            help="puzzle file, '-' for stdout")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    puzzles = generate_many(args.count, args.seed, args.workers, args.clues,
+            args.symmetry, args.attempts)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for puzzle in puzzles:
+            out.write(sudoku.format_grid(puzzle) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
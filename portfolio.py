@@ -0,0 +1,359 @@
+#!/usr/bin/python3
+"""
+Race differently configured solvers on one puzzle
+
+A single search order can be unlucky on an adversarial puzzle, another
+order rarely is on the same one.  A Portfolio keeps one worker process per
+configuration and hands each puzzle to all of them; the first definitive
+answer (solved, no solution, or with unique=True exactly one / several
+solutions) wins and the rest are cancelled.  This is for the latency of one
+hard puzzle, sudoku.solve_many() is the way to throughput.
+
+Configurations are names:
+    board, logic, dlx       the sudoku.ENGINES of those names
+    shuffle:SEED            board, branching cell ties and values in a
+                            seeded random order
+    restart:SEED            shuffle, starting over with a new order after
+                            10ms, 20ms, 40ms, ... without an answer
+
+A loser is cancelled with SIGUSR1, which sets its solver's deadline to 0,
+so the search stops at its next node without checking anything new.
+
+    ./portfolio.py -s 5 --unique corpora/hard.txt
+"""
+
+import os
+import sys
+import time
+import random
+import signal
+import logging
+import argparse
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.connection
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIGS = ("board", "dlx", "shuffle:1", "restart:2", "logic", "shuffle:3",
+        "restart:4", "shuffle:5")
+# answers that end a race, without / with unique
+_DEFINITIVE = ({"solved", "unique", "multiple", "none"}, {"unique", "multiple", "none"})
+_FIRST_SLICE = 0.01     # restart: seconds for the first order, doubling after
+
+
+class Answer(object):
+    """ what race() hands back: status is "solved" (a solution, not known
+        to be the only one), "unique", "multiple", "none" or "timeout",
+        config the configuration that answered
+    """
+    __slots__ = ('status', 'grid', 'config', 'nodes', 'seconds')
+
+    def __init__(self, status, grid, config=None, nodes=0, seconds=0.0):
+        self.status = status
+        self.grid = grid
+        self.config = config
+        self.nodes = nodes
+        self.seconds = seconds
+
+    @property
+    def solved(self):
+        return self.status in ("solved", "unique", "multiple")
+
+    def __repr__(self):
+        return "Answer({}, config={}, nodes={}, seconds={:.4f})".format(
+            self.status, self.config, self.nodes, self.seconds)
+
+
+class _ShuffledBoard(sudoku.Board):
+    """ a Board branching on a fewest options cell picked in its own
+        order rather than reading order
+    """
+    order = None
+
+    def _branch_cell(self):
+        masks, values = self.masks, self.values
+        topo = self.topo
+        popcount = topo.popcount
+        pos, fewest = None, topo.size + 1
+        for p in self.order:
+            if not values[p] and popcount[masks[p]] < fewest:
+                pos, fewest = p, popcount[masks[p]]
+                if fewest == 2:
+                    break
+        return pos
+
+
+def _parse_config(config):
+    """ (kind, seed) for a configuration name """
+    kind, _, seed = config.partition(':')
+    if kind in sudoku.ENGINES and not seed:
+        return kind, None
+    if kind in ("shuffle", "restart"):
+        try:
+            return kind, int(seed)
+        except ValueError:
+            pass
+    raise ValueError("unknown configuration {!r}, try {}".format(
+        config, ', '.join(DEFAULT_CONFIGS)))
+
+
+class _Job(object):
+    """ the worker's current puzzle, for the cancel signal to find """
+    id = 0
+    solver = None
+    stopped = False
+
+
+_job = _Job()
+_cancelled = None       # shared: every job up to this id is cancelled
+
+
+def _on_cancel(signum, frame):
+    if _cancelled.value >= _job.id and not _job.stopped:
+        _job.stopped = True
+        if _job.solver is not None:
+            _job.solver.deadline = 0
+
+
+def _board_attempt(grid, deadline, unique, rng=None, max_cost=None):
+    """ (status, grid, nodes) from one Board run, "timeout" when the
+        deadline cut it short
+    """
+    try:
+        board = sudoku.Board(grid) if rng is None else _ShuffledBoard(grid)
+    except ValueError:
+        return "none", grid, 0
+    if rng is not None:
+        board.order = rng.sample(board.topo.cells, board.topo.count)
+    board.deadline = deadline
+    _job.solver = board
+    if _job.stopped:
+        board.deadline = 0
+    if not board.solve(show=False, max_cost=max_cost):
+        return "none", grid, 0
+    if unique:
+        solutions = board.solutions(rng)
+        found = list(itertools.islice(solutions, 2))
+        solutions.close()
+    else:
+        found = [board.export()] if board.search(rng) else []
+    out = time.perf_counter() > board.deadline
+    if len(found) == 2:
+        return "multiple", found[0], board.nodes
+    if found:
+        return ("solved" if out or not unique else "unique"), found[0], board.nodes
+    return ("timeout" if out else "none"), board.export(), board.nodes
+
+
+def _attempt(config, grid, seconds, unique):
+    kind, seed = _parse_config(config)
+    deadline = time.perf_counter() + seconds if seconds is not None else float('inf')
+    if kind == "dlx":
+        ec = sudoku.ExactCover(grid)
+        ec.deadline = deadline
+        _job.solver = ec
+        if _job.stopped:
+            ec.deadline = 0
+        solved = ec.consistent and ec.search()
+        if solved:
+            # whether it is the only one dlx can't say
+            return "solved", ec.export(), ec.nodes
+        out = time.perf_counter() > ec.deadline
+        return ("timeout" if out else "none"), grid, ec.nodes
+    if kind in ("board", "logic"):
+        return _board_attempt(grid, deadline, unique,
+                max_cost=float('inf') if kind == "logic" else None)
+
+    rng = random.Random(seed)
+    if kind == "shuffle" or unique:
+        return _board_attempt(grid, deadline, unique, rng)
+    nodes = 0
+    slice_seconds = _FIRST_SLICE
+    while not _job.stopped:
+        status, out, spent = _board_attempt(grid,
+                min(deadline, time.perf_counter() + slice_seconds), unique, rng)
+        nodes += spent
+        if status != "timeout" or time.perf_counter() > deadline:
+            return status, out, nodes
+        log.debug("Restarting %s after %s nodes", config, spent)
+        slice_seconds *= 2
+    return "timeout", grid, nodes
+
+
+def _worker(conn, cancelled, config):
+    """ solve every puzzle conn sends with config until it sends None """
+    global _cancelled
+    _cancelled = cancelled
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, _on_cancel)
+    sudoku.topology(3)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        job_id, grid, seconds, unique = job
+        _job.solver = None
+        _job.stopped = False
+        _job.id = job_id
+        if cancelled.value >= job_id:
+            _job.stopped = True
+        started = time.perf_counter()
+        try:
+            status, out, nodes = _attempt(config, grid, seconds, unique)
+        except Exception as e:
+            log.warning("%s failed: %s", config, e)
+            status, out, nodes = "error", grid, 0
+        _job.solver = None
+        conn.send((job_id, status, out, nodes, time.perf_counter() - started))
+
+
+class Portfolio(object):
+    """ one warm worker process per configuration, racing on each puzzle
+
+        race() is safe to call from several threads, the races just take
+        turns; close() (or leaving a with block) stops the workers
+    """
+    def __init__(self, configs=None, context=None):
+        configs = list(configs or DEFAULT_CONFIGS[:max(2, os.cpu_count() or 1)])
+        for config in configs:
+            _parse_config(config)
+        ctx = multiprocessing.get_context(context)
+        self.cancelled = ctx.RawValue('q', 0)
+        self.lock = threading.Lock()
+        self.job_id = 0
+        self.workers = {}   # connection -> (config, process)
+        for config in configs:
+            conn, child = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(child, self.cancelled, config),
+                    daemon=True)
+            process.start()
+            child.close()
+            self.workers[conn] = (config, process)
+        self.wins = dict.fromkeys(configs, 0)
+
+    def close(self):
+        for conn, (config, process) in self.workers.items():
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for conn, (config, process) in self.workers.items():
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self.workers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _cancel(self, job_id, running):
+        self.cancelled.value = job_id
+        for conn in running:
+            try:
+                os.kill(self.workers[conn][1].pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    def _drop(self, conn):
+        config, process = self.workers.pop(conn)
+        log.warning("Worker for %s died (exit %s)", config, process.exitcode)
+        conn.close()
+
+    def race(self, grid, max_seconds=None, unique=False):
+        """ the first definitive Answer for grid, or after max_seconds the
+            best seen so far (a solution, or "timeout")
+        """
+        with self.lock:
+            if not self.workers:
+                raise RuntimeError("the portfolio has no workers left")
+            started = time.perf_counter()
+            self.job_id += 1
+            job_id = self.job_id
+            for conn in list(self.workers):
+                try:
+                    conn.send((job_id, grid, max_seconds, unique))
+                except OSError:
+                    self._drop(conn)
+            running = set(self.workers)
+            definitive = _DEFINITIVE[bool(unique)]
+            best = Answer("timeout", grid)
+            try:
+                while running:
+                    timeout = None
+                    if max_seconds is not None:
+                        timeout = started + max_seconds - time.perf_counter()
+                        if timeout <= 0:
+                            break
+                    ready = multiprocessing.connection.wait(running, timeout)
+                    if not ready:
+                        break
+                    for conn in ready:
+                        try:
+                            message = conn.recv()
+                        except (EOFError, OSError):
+                            running.discard(conn)
+                            self._drop(conn)
+                            continue
+                        if message[0] != job_id:
+                            continue    # a cancelled race finishing late
+                        running.discard(conn)
+                        _, status, out, nodes, seconds = message
+                        config = self.workers[conn][0]
+                        log.debug("%s: %s in %.4fs", config, status, seconds)
+                        if status in definitive:
+                            self.wins[config] += 1
+                            return Answer(status, out, config, nodes,
+                                    time.perf_counter() - started)
+                        if status == "solved" and not best.solved:
+                            best = Answer(status, out, config, nodes)
+                best.seconds = time.perf_counter() - started
+                return best
+            finally:
+                self._cancel(job_id, running)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Race several solver "
+            "configurations on each puzzle, taking the first definitive answer")
+    parser.add_argument('files', nargs='*', default=['-'],
+            help="puzzle files, '-' or nothing for stdin")
+    parser.add_argument('-c', '--config', action='append',
+            help="configuration to race, repeat for several "
+            "(default up to one per cpu of: {})".format(', '.join(DEFAULT_CONFIGS)))
+    parser.add_argument('-s', '--max-seconds', type=float,
+            help="wall clock budget per puzzle")
+    parser.add_argument('-u', '--unique', action='store_true',
+            help="settle whether the solution is unique too")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose > 1
+            else logging.INFO if args.verbose else logging.WARNING)
+    failed = 0
+    with Portfolio(args.config) as portfolio:
+        for grid in sudoku.read_puzzles(args.files):
+            answer = portfolio.race(grid, args.max_seconds, args.unique)
+            log.info("%r", answer)
+            print(sudoku.format_grid(answer.grid) if answer.solved else "-", answer.status,
+                    answer.config or "", "{:.4f}".format(answer.seconds))
+            failed += not answer.solved
+        log.info("Wins: %s", portfolio.wins)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+"""
+A long running local solve service
+
+Keeps the interpreter, the grid tables and a pool of worker processes warm
+so a request only pays for its solve.  Puzzles from concurrent requests are
+gathered into batches (up to --batch puzzles, waiting at most --wait-ms for
+more) before going to the pool.
+
+Both transports take puzzles one per line in the 81 character format and
+answer one line per puzzle, in order: the solution, '-' when there is none,
+or 'error: ...' for a line that isn't a puzzle.
+
+    ./service.py --socket /tmp/sudoku.sock      # line protocol, any client
+    ./service.py --port 8765                    # POST /solve, GET /stats
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import socketserver
+import http.server
+import concurrent.futures
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+
+def _warm(_):
+    """ run once in each worker so the first real batch finds it ready """
+    sudoku.topology(3)
+    return os.getpid()
+
+
+class Batcher(object):
+    """ gathers puzzles from any number of threads into chunks for a pool
+
+        submit() hands back a Future for the puzzle's Result.  A worker
+        count of 1 solves in the batcher's own thread, saving the trip to
+        another process
+    """
+    def __init__(self, engine="board", workers=None, max_batch=64, max_wait=0.002):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        if self.workers > 1:
+            self.pool = self._start_pool()
+        self.stats = sudoku.Stats()
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _start_pool(self):
+        pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        pids = set(pool.map(_warm, range(self.workers)))
+        log.info("%s workers warm", len(pids))
+        return pool
+
+    def _replace_pool(self, broken):
+        """ a dead worker takes the whole pool down: start a fresh one,
+            once however many batches saw the old one break
+        """
+        with self.lock:
+            if self.pool is not broken:
+                return
+            log.error("Worker pool broke, starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            try:
+                self.pool = self._start_pool()
+            except Exception as e:
+                log.critical("No new pool (%s), solving in the batcher thread", e)
+                self.pool = None
+
+    def submit(self, grid):
+        future = concurrent.futures.Future()
+        self.pending.put((grid, future))
+        return future
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def _gather(self):
+        """ block for one puzzle, then take whatever else arrives in time """
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.pending.get(timeout=timeout) if timeout > 0 \
+                    else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._gather()
+            if batch is None:
+                return
+            grids = [grid for grid, _ in batch]
+            futures = [future for _, future in batch]
+            log.debug("Batch of %s", len(batch))
+            if self.pool is None:
+                try:
+                    self._finish(futures, sudoku._solve_chunk(grids, self.engine))
+                except Exception as e:
+                    self._fail(futures, e)
+            else:
+                pool = self.pool
+                try:
+                    done = pool.submit(sudoku._solve_chunk, grids, self.engine)
+                except Exception as e:
+                    self._fail(futures, e)
+                    if isinstance(e, concurrent.futures.BrokenExecutor):
+                        self._replace_pool(pool)
+                    continue
+                done.add_done_callback(lambda done, futures=futures, pool=pool:
+                        self._collect(done, futures, pool))
+
+    def _collect(self, done, futures, pool):
+        try:
+            results = done.result()
+        except Exception as e:
+            self._fail(futures, e)
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                # not from the pool's own callback thread, which shutdown joins
+                threading.Thread(target=self._replace_pool, args=(pool,), daemon=True).start()
+        else:
+            self._finish(futures, results)
+
+    def _finish(self, futures, results):
+        with self.lock:
+            for result in results:
+                self.stats.add(result)
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def _fail(self, futures, error):
+        log.warning("Batch failed: %s", error)
+        for future in futures:
+            future.set_exception(error)
+
+    def solve_lines(self, lines):
+        """ answer lines for puzzle lines, blank / '#' lines get no answer """
+        futures = []
+        for line in lines:
+            try:
+                grid = sudoku.parse_line(line)
+            except ValueError as e:
+                futures.append("error: {}".format(e))
+                continue
+            if grid is not None:
+                futures.append(self.submit(grid))
+        return [_answer(future) for future in futures]
+
+
+def _answer(future):
+    if isinstance(future, str):
+        return future
+    try:
+        result = future.result()
+    except Exception as e:
+        return "error: {}".format(e)
+    return sudoku.format_grid(result.grid) if result.solved else "-"
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    """ one connection: lines are read and handed to the batcher as they
+        come while a writer thread sends answers back in order
+    """
+    def handle(self):
+        answers = queue.Queue()
+        writer = threading.Thread(target=self._write, args=(answers,))
+        writer.start()
+        try:
+            for line in self.rfile:
+                try:
+                    grid = sudoku.parse_line(line)
+                except ValueError as e:
+                    answers.put("error: {}".format(e))
+                    continue
+                if grid is not None:
+                    answers.put(self.server.batcher.submit(grid))
+        finally:
+            answers.put(None)
+            writer.join()
+
+    def _write(self, answers):
+        while True:
+            future = answers.get()
+            if future is None:
+                return
+            try:
+                self.wfile.write(_answer(future).encode('ascii') + b'\n')
+                if answers.empty():
+                    self.wfile.flush()
+            except OSError:
+                log.info("Client went away")
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _HTTPHandler(http.server.BaseHTTPRequestHandler):
+    """ POST /solve with puzzle lines, GET /stats for the running totals """
+    def do_POST(self):
+        if self.path != '/solve':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        lines = self.rfile.read(length).splitlines()
+        self._reply('\n'.join(self.server.batcher.solve_lines(lines)) + '\n', 'text/plain')
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        batcher = self.server.batcher
+        with batcher.lock:
+            stats = batcher.stats.as_dict()
+        self._reply(json.dumps(stats, sort_keys=True) + '\n', 'application/json')
+
+    def _reply(self, text, content_type):
+        body = text.encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt, *args)
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def serve(batcher, socket_path=None, port=None):
+    """ run the servers until interrupted, the Unix socket one, the
+        localhost HTTP one or both
+    """
+    servers = []
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        servers.append(_UnixServer(socket_path, _LineHandler))
+        log.warning("Listening on %s", socket_path)
+    if port is not None:
+        servers.append(_HTTPServer(('127.0.0.1', port), _HTTPHandler))
+        log.warning("Listening on http://127.0.0.1:%s", servers[-1].server_address[1])
+    threads = []
+    for server in servers:
+        server.batcher = batcher
+        threads.append(threading.Thread(target=server.serve_forever, daemon=True))
+        threads[-1].start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Serve sudoku solves over a "
+            "Unix socket and / or localhost HTTP from warm workers")
+    parser.add_argument('--socket', metavar='PATH', help="Unix socket to listen on")
+    parser.add_argument('--port', type=int,
+            help="localhost HTTP port (default 8765 when no --socket)")
+    parser.add_argument('-e', '--engine', default='board', choices=sorted(sudoku.ENGINES))
+    parser.add_argument('-j', '--workers', type=int, default=0,
+            help="solver processes, 0 for one per cpu, 1 to solve in process")
+    parser.add_argument('--batch', type=int, default=64,
+            help="most puzzles sent to a worker at once")
+    parser.add_argument('--wait-ms', type=float, default=2.0,
+            help="how long a batch waits for more puzzles")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    # -v is for the service, -vv also gets the solver's own chatter
+    logging.basicConfig(level=logging.DEBUG if args.verbose > 1 else logging.WARNING)
+    if args.verbose == 1:
+        log.setLevel(logging.INFO)
+    port = args.port if args.port is not None or args.socket else 8765
+    batcher = Batcher(args.engine, args.workers, args.batch, args.wait_ms/1000)
+    try:
+        serve(batcher, args.socket, port)
+    finally:
+        batcher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+"""
+A puzzle being played, for interactive front ends
+
+A Session holds the givens and the player's entries and keeps every cell's
+candidates up to date as entries come and go, instead of building a new
+Board per move.  Board candidates only ever shrink, which is why erasing an
+entry can't be done on one; here each unit counts how many of its cells
+hold each digit, so a cell's candidates are the digits no peer holds and
+place / erase / undo only touch the cell's peers.
+
+    game = Session(grid)
+    game.place(0, 2, 4)
+    game.candidates(0, 3)
+    game.conflicts()
+    game.hint()         # (row, col, value, technique) or None
+"""
+
+import sys
+import math
+import logging
+import argparse
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+
+class Session(object):
+    """ givens plus the player's entries with the candidates of every cell
+        kept current; rows and cols count from 0
+
+        entries may clash with each other or the givens, conflicts() says
+        where.  The candidates of a filled cell are what it could hold
+        given its peers, so they stay meaningful under an erase
+    """
+    def __init__(self, init):
+        topo = self.topo = sudoku.topology_of(init)
+        size = topo.size
+        self.given = [v for row in init for v in row]
+        self.values = [0] * topo.count
+        self.masks = [topo.all_options] * topo.count
+        # unit*size + val - 1 -> cells of the unit holding val
+        self.counts = [0] * (len(topo.units) * size)
+        self.history = []   # (pos, old value, new value) per move, for undo()
+        for pos, val in enumerate(self.given):
+            if val:
+                if not 0 < val <= size:
+                    raise ValueError("{} = {} is out of range".format(topo.ndx[pos], val))
+                self._set(pos, val)
+        clashes = self.conflicts()
+        if clashes:
+            raise ValueError("the givens clash at {}".format(clashes))
+
+    def _set(self, pos, val):
+        """ put val (0 for none) at pos, adjusting the unit counts and the
+            peers' candidates for the digit leaving and the one arriving
+        """
+        old = self.values[pos]
+        if old:
+            self._count(pos, old, -1)
+        self.values[pos] = val
+        if val:
+            self._count(pos, val, 1)
+
+    def _count(self, pos, val, step):
+        topo = self.topo
+        size = topo.size
+        units_of = topo.units_of
+        counts = self.counts
+        masks = self.masks
+        d = val - 1
+        bit = 1 << d
+        for unit in units_of[pos]:
+            counts[unit*size + d] += step
+        if step > 0:
+            for p in topo.peers[pos]:
+                masks[p] &= ~bit
+            return
+        # leaving: a peer gets val back unless another of its peers holds it
+        values = self.values
+        for p in topo.peers[pos]:
+            own = values[p] == val
+            row, col, box = units_of[p]
+            if (counts[row*size + d] > own or counts[col*size + d] > own
+                    or counts[box*size + d] > own):
+                continue
+            masks[p] |= bit
+
+    def _pos(self, row, col):
+        size = self.topo.size
+        if not (0 <= row < size and 0 <= col < size):
+            raise ValueError("no cell {},{} on a {}x{} grid".format(row, col, size, size))
+        return row*size + col
+
+    def place(self, row, col, val):
+        """ enter val at row, col, replacing whatever the player had there """
+        pos = self._pos(row, col)
+        if not 0 < val <= self.topo.size:
+            raise ValueError("{} is out of range".format(val))
+        if self.given[pos]:
+            raise ValueError("{} is a given".format(self.topo.ndx[pos]))
+        old = self.values[pos]
+        if old != val:
+            self.history.append((pos, old, val))
+            self._set(pos, val)
+
+    def erase(self, row, col):
+        pos = self._pos(row, col)
+        if self.given[pos]:
+            raise ValueError("{} is a given".format(self.topo.ndx[pos]))
+        old = self.values[pos]
+        if old:
+            self.history.append((pos, old, 0))
+            self._set(pos, 0)
+
+    def undo(self):
+        """ take back the last place / erase, False when there is none """
+        if not self.history:
+            return False
+        pos, old, _ = self.history.pop()
+        self._set(pos, old)
+        return True
+
+    def value(self, row, col):
+        return self.values[self._pos(row, col)]
+
+    def candidates(self, row, col):
+        """ the values no peer of row, col holds """
+        return self.topo.mask_values[self.masks[self._pos(row, col)]]
+
+    def conflicts(self):
+        """ sorted (row, col) of filled cells sharing their value with a
+            peer and of blank cells no value is left for
+        """
+        topo = self.topo
+        size = topo.size
+        counts = self.counts
+        values = self.values
+        masks = self.masks
+        clashes = []
+        for pos in topo.cells:
+            val = values[pos]
+            if val:
+                d = val - 1
+                if any(counts[unit*size + d] > 1 for unit in topo.units_of[pos]):
+                    clashes.append(divmod(pos, size))
+            elif not masks[pos]:
+                clashes.append(divmod(pos, size))
+        return clashes
+
+    @property
+    def solved(self):
+        return all(self.values) and not self.conflicts()
+
+    def export(self):
+        size = self.topo.size
+        return [self.values[row*size:(row + 1)*size] for row in range(size)]
+
+    def board(self):
+        """ a Board of the current entries built from the session's own
+            candidates, without replaying the entries through assign()
+
+            None when the entries conflict or a blank has a single
+            candidate, which a Board would have to propagate first
+        """
+        topo = self.topo
+        values = self.values
+        masks = self.masks
+        popcount = topo.popcount
+        buffer = []
+        uncertainty = 0
+        for pos in topo.cells:
+            if values[pos]:
+                buffer.append(1 << (values[pos] - 1))
+            else:
+                options = popcount[masks[pos]]
+                if options < 2:
+                    return None
+                uncertainty += options
+                buffer.append(masks[pos])
+        if self.conflicts():
+            return None
+        buffer.extend(values)
+        buffer.append(uncertainty)
+        return sudoku.Board.from_buffer(buffer)
+
+    def hint(self, max_cost=None):
+        """ a blank the rules can fill as (row, col, value, technique), or
+            None when they can't or the entries conflict
+
+            a blank down to one candidate is a "naked_single", otherwise the
+            Board techniques up to max_cost (Board.MAX_COST by default) run
+            on board() until one of them fills a blank
+        """
+        topo = self.topo
+        size = topo.size
+        values = self.values
+        masks = self.masks
+        popcount = topo.popcount
+        for pos in topo.cells:
+            if not values[pos] and popcount[masks[pos]] == 1:
+                if self.conflicts():
+                    return None
+                return pos // size, pos % size, masks[pos].bit_length(), "naked_single"
+        board = self.board()
+        if board is None:
+            return None
+        for name, ok in board.steps(max_cost):
+            if not ok:
+                log.info("Entries contradict at %s", name)
+                return None
+            for pos in topo.cells:
+                if board.values[pos] and not values[pos]:
+                    return pos // size, pos % size, board.values[pos], name
+        return None
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Play a puzzle through on "
+            "hints alone, printing each one")
+    parser.add_argument('puzzle', help="81 characters, 0 or . for blanks")
+    parser.add_argument('--max-cost', type=float, default=math.inf,
+            help="dearest technique a hint may use (default all)")
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    game = Session(sudoku.parse_line(args.puzzle))
+    while True:
+        hint = game.hint(args.max_cost)
+        if hint is None:
+            break
+        row, col, val, name = hint
+        print("{},{} = {} by {}".format(row, col, val, name))
+        game.place(row, col, val)
+    print(sudoku.format_grid(game.export()))
+    return 0 if game.solved else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,15 +10,17 @@ A = [[a11 a12 a13],
 """
 
 import os
-import re
+import time
+import json
+import functools
+import sys
+import mmap
+import array
+import collections
+import concurrent.futures
 import math
-import cmath
-import random
 import itertools
 import logging
-import argparse
-import numpy as np
-from matplotlib import pyplot as plt
 
 log = logging.getLogger(__name__)
 
@@ -27,147 +29,529 @@ _BOX_LABELS = [["top left", "top center", "top right"],
         ["bottom left", "bottom center", "bottom right"]]
 
 
+def _bit(val):
+    return 1 << (val - 1)
+
+
+class _MaskTable(dict):
+    """ mask -> fcn(mask) filled in on first use, for boards whose masks
+        are too wide to tabulate up front
+    """
+    def __init__(self, fcn):
+        super().__init__()
+        self.fcn = fcn
+
+    def __missing__(self, mask):
+        value = self[mask] = self.fcn(mask)
+        return value
+
+
+def _units_in(unit_mask):
+    """ yield the unit numbers set in a unit mask """
+    while unit_mask:
+        low = unit_mask & -unit_mask
+        yield low.bit_length() - 1
+        unit_mask ^= low
+
+
+class Topology(object):
+    """ static tables for a grid of box x box boxes, each box x box cells,
+        so size = box**2 values, rows and cols; use topology(box) to share
+        one per box size
+
+        cells are numbered row*size + col, units are the size rows, then
+        the size cols, then the size boxes (numbered in reading order, cells
+        in reading order).  Candidates are masks with bit (val - 1) set for
+        each candidate val, mask_values / popcount map a mask to its values
+        / their count; they are full tuples for 9x9 and fill in lazily
+        beyond that
+    """
+    def __init__(self, box):
+        size = box*box
+        self.box, self.size, self.count = box, size, size*size
+        self.all_options = (1 << size) - 1
+        values = lambda m: tuple(v for v in range(1, size + 1) if m & _bit(v))
+        if box <= 3:
+            self.mask_values = tuple(values(m) for m in range(self.all_options + 1))
+            self.popcount = tuple(len(vals) for vals in self.mask_values)
+        else:
+            self.mask_values = _MaskTable(values)
+            self.popcount = _MaskTable(int.bit_count)
+
+        self.cells = tuple(range(self.count))
+        self.rows = tuple(tuple(row*size + col for col in range(size)) for row in range(size))
+        self.cols = tuple(tuple(row*size + col for row in range(size)) for col in range(size))
+        self.boxes = tuple(tuple(row*size + col
+                    for row in range(box*box_row, box*box_row + box)
+                    for col in range(box*box_col, box*box_col + box))
+                for box_row in range(box) for box_col in range(box))
+        self.units = self.rows + self.cols + self.boxes
+        # the (row, col, box) unit numbers of each cell
+        self.units_of = tuple((pos // size, size + pos % size,
+                2*size + (pos // (size*box))*box + (pos % size) // box)
+            for pos in self.cells)
+        # the other cells sharing a unit with each cell, row then col then box
+        self.peers = tuple(tuple(p for unit in self.units_of[pos] for p in self.units[unit]
+                    if p != pos and (unit < 2*size
+                        or (p // size != pos // size and p % size != pos % size)))
+                for pos in self.cells)
+        self.peer_sets = tuple(frozenset(peers) for peers in self.peers)
+        # the units of each cell as a bit mask over the unit numbers
+        self.unit_bits = tuple((1 << row) | (1 << col) | (1 << box_unit)
+                for row, col, box_unit in self.units_of)
+        self.all_units = (1 << len(self.units)) - 1
+        self.ndx = tuple("{},{}".format(*divmod(pos, size)) for pos in self.cells)
+        # array type wide enough for a mask, for Board.snapshot()
+        self.typecode = 'H' if size <= 16 else 'L'
+        self.row_box = self._intersections(self.rows, 0)
+        self.col_box = self._intersections(self.cols, 1)
+
+    def _intersections(self, lines, axis):
+        """ for each line / box overlap:
+                (line, block, segment, line_rest, box_rest, unit_mask)
+            where block is the index of the segment within the line and
+            unit_mask has the line and box unit bits
+        """
+        box = self.box
+        table = []
+        for line_no, line in enumerate(lines):
+            for block in range(box):
+                segment = line[block*box:block*box + box]
+                box_unit = self.units_of[segment[0]][2]
+                line_unit = self.units_of[segment[0]][axis]
+                cells = self.units[box_unit]
+                table.append((line_no, block, segment,
+                    tuple(p for p in line if p not in segment),
+                    tuple(p for p in cells if p not in segment),
+                    (1 << line_unit) | (1 << box_unit)))
+        return tuple(table)
+
+    def box_label(self, box_unit):
+        """ name of a box by its number among the boxes """
+        if self.box == 3:
+            return _BOX_LABELS[box_unit // 3][box_unit % 3]
+        return "{},{}".format(*divmod(box_unit, self.box))
+
+
+@functools.lru_cache(maxsize=None)
+def topology(box=3):
+    return Topology(box)
+
+
+def topology_of(grid):
+    """ the Topology for a square list of lists grid, 9x9, 16x16, ... """
+    box = math.isqrt(len(grid))
+    if box < 2 or box*box != len(grid) or any(len(row) != len(grid) for row in grid):
+        raise ValueError("a grid must be n**2 rows of n**2 values, not {} rows".format(
+            len(grid)))
+    return topology(box)
+
+
+""" the standard 9x9 tables, module level for the common case """
+TOPOLOGY = topology(3)
+_ALL_OPTIONS = TOPOLOGY.all_options    # bit (val - 1) set for each candidate val
+# candidate values and counts for every 9-bit mask, e.g. 0b101 -> (1, 3)
+_MASK_VALUES = TOPOLOGY.mask_values
+_POPCOUNT = TOPOLOGY.popcount
+CELLS = TOPOLOGY.cells
+ROWS, COLS, BOXES = TOPOLOGY.rows, TOPOLOGY.cols, TOPOLOGY.boxes
+UNITS = TOPOLOGY.units
+UNITS_OF = TOPOLOGY.units_of
+PEERS = TOPOLOGY.peers
+UNIT_BITS = TOPOLOGY.unit_bits
+ALL_UNITS = TOPOLOGY.all_units
+ROW_BOX, COL_BOX = TOPOLOGY.row_box, TOPOLOGY.col_box
+
+
+def _closed_groups(items, limit, popcount=_POPCOUNT):
+    """ find groups of up to limit (key, mask) items whose masks together
+        hold exactly as many bits as there are items in the group, counting
+        bits with popcount (a Topology's, for boards other than 9x9)
+
+        yields (OR of keys, OR of masks) for each group, or (keys, None)
+        when a group has fewer bits than items, which can't be satisfied.
+        Branches are cut as soon as the union has more than limit bits, and
+        a closed group is not grown any further
+    """
+    def grow(start, size, keys, union):
+        for n in range(start, len(items)):
+            key, mask = items[n]
+            joined = union | mask
+            bits = popcount[joined]
+            if bits > limit:
+                continue
+            if bits < size + 1:
+                yield keys | key, None
+            elif bits == size + 1:
+                yield keys | key, joined
+            elif size + 1 < limit:
+                yield from grow(n + 1, size + 1, keys | key, joined)
+    return grow(0, 0, 0, 0)
+
+
+class Instruments(object):
+    """ per technique counters and timers, attach one to a Board to turn
+        them on; a Board without one only pays a None check per technique
+        call
+
+        counters[name] holds passes (calls), placements, eliminations and
+        seconds; search also gets nodes and backtracks.  Timings and counts
+        are inclusive, so search includes the direct_elim runs it makes.
+        Each hook is called as hook(name, amounts) after every update
+    """
+    def __init__(self, hooks=()):
+        self.counters = {}
+        self.hooks = list(hooks)
+
+    def count(self, name, **amounts):
+        totals = self.counters.setdefault(name, collections.Counter())
+        totals.update(amounts)
+        for hook in self.hooks:
+            hook(name, amounts)
+
+    def measure(self, name, fcn, board, args, kwargs):
+        placed, removed = board.placed, board.removed
+        start = time.perf_counter()
+        try:
+            return fcn(board, *args, **kwargs)
+        finally:
+            self.count(name, passes=1, seconds=time.perf_counter() - start,
+                placements=board.placed - placed,
+                eliminations=board.removed - removed)
+
+    def as_dict(self):
+        return {name: dict(totals) for name, totals in self.counters.items()}
+
+
+def _instrumented(fcn):
+    """ route a Board technique through board.instruments when it has one """
+    name = fcn.__name__
+    @functools.wraps(fcn)
+    def wrapper(self, *args, **kwargs):
+        if self.instruments is None:
+            return fcn(self, *args, **kwargs)
+        return self.instruments.measure(name, fcn, self, args, kwargs)
+    return wrapper
+
+
 class Board(object):
-    def __init__(self, init):
-        self.matrix = [list(range(9)) for _ in range(9)]
-        def mk_lambda(r, c):
-            return lambda val : self.update(r, c, val)
-        for row in range(9):
-            for col in range(9):
-                cell = Cell(row, col)
-                #log.debug("Cell {} update is {},{}".format(cell.ndx, row, col))
-                self.matrix[row][col] = cell
-                cell.set_notification(mk_lambda(row, col))
-        for row in range(9):
-            for col in range(9):
-                cell = self.matrix[row][col]
-                init_val = init[row][col]
-                if init_val != 0:
-                    log.info("Init of {} = {}".format(cell.ndx, init_val))
-                    cell.set(init_val)
-        log.info("Initial uncertainty {}".format(self.get_uncertainty()))
+    # rule techniques solve() schedules, name -> relative cost per call
+    TECHNIQUES = {"direct_elim": 1, "box_sets": 2, "close_sets": 4, "fish": 5,
+            "xy_wing": 6, "coloring": 7}
+    # solve() leaves out techniques costing more unless told otherwise: the
+    # pattern ones cut search nodes but on most puzzles take longer than
+    # the search they save
+    MAX_COST = 4
+    MAX_SUBSET = 4      # largest naked / hidden group close_sets looks for
+
+    def __init__(self, init, instruments=None):
+        """ candidates live in one flat list of masks owned by the board,
+            the Cell objects in cells / matrix are views onto them, made
+            the first time they are asked for
+
+            init is a list of lists, 9x9 or any other n**2 square (16x16,
+            25x25, ...), with 0 for blanks
+        """
+        topo = topology_of(init)
+        size = topo.size
+        self._setup(topo, instruments)
+        self.masks = [topo.all_options] * topo.count
+        self.values = [0] * topo.count
+        self.uncertainty = topo.count * size
+        for pos in topo.cells:
+            init_val = init[pos // size][pos % size]
+            if init_val != 0:
+                log.info("Init of %s = %s", topo.ndx[pos], init_val)
+                if not 0 < init_val <= size or not self.assign(pos, init_val):
+                    raise ValueError("{} = {} contradicts the other givens".format(
+                        topo.ndx[pos], init_val))
+        log.info("Initial uncertainty %s", self.get_uncertainty())
+        self.changed = 0
+
+    def _setup(self, topo, instruments):
+        """ everything but the candidates """
+        self.topo = topo
+        self.trail = None       # (pos, mask) undo entries while searching
+        self.queue = collections.deque()    # solved cells not yet propagated
+        self.changed = 0        # units with eliminations not yet handed out
+        # units each technique still has to look at
+        self.dirty = dict.fromkeys(self.TECHNIQUES, topo.all_units)
+        self._places = None     # _digit_places() table, kept between calls
+        self.nodes = self.backtracks = 0
+        self.placed = self.removed = 0      # running totals for Instruments
+        self.instruments = instruments
+        self.deadline = None    # perf_counter() time solve / search give up at
+        self._cells = None
+
+    @classmethod
+    def from_buffer(cls, buffer, instruments=None):
+        """ a Board from a snapshot() buffer (or any sequence laid out the
+            same way), without replaying the givens
+        """
+        board = cls.__new__(cls)
+        count = (len(buffer) - 1) // 2
+        board._setup(topology(math.isqrt(math.isqrt(count))), instruments)
+        if 2*board.topo.count + 1 != len(buffer):
+            raise ValueError("a board buffer has 2 * cells + 1 entries, not {}".format(
+                len(buffer)))
+        board.masks = list(buffer[:count])
+        board.values = list(buffer[count:2*count])
+        board.uncertainty = buffer[-1]
+        return board
+
+    def snapshot(self):
+        """ the candidates as one compact array: the masks, the solved
+            values, then the uncertainty
+
+            masks stay in plain lists while solving as those index faster
+            than an array, the snapshot is the one allocation
+        """
+        buffer = array.array(self.topo.typecode, self.masks)
+        buffer.extend(self.values)
+        buffer.append(self.uncertainty)
+        return buffer
+
+    def restore(self, buffer):
+        """ go back to a snapshot() of this board, in place
+
+            every unit is marked dirty as the techniques can't tell what
+            changed; not for use under a search trail
+        """
+        count = self.topo.count
+        view = memoryview(buffer)
+        self.masks[:] = view[:count]
+        self.values[:] = view[count:2*count]
+        self.uncertainty = buffer[-1]
+        self.queue.clear()
+        self.changed = self.topo.all_units
+
+    @classmethod
+    def register(cls, fcn, cost):
+        """ add fcn(board) as a rule technique for solve() to schedule
+
+            like the built in ones it should look at the units
+            board.take_dirty(fcn.__name__) hands it and return False on a
+            contradiction
+        """
+        setattr(cls, fcn.__name__, _instrumented(fcn))
+        cls.TECHNIQUES = dict(cls.TECHNIQUES, **{fcn.__name__: cost})
+        return fcn
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            size = self.topo.size
+            self._cells = [Cell(pos // size, pos % size, self) for pos in self.topo.cells]
+        return self._cells
+
+    @property
+    def matrix(self):
+        size = self.topo.size
+        return [self.cells[row*size:row*size + size] for row in range(size)]
 
     def get_uncertainty(self):
-        uncertainty = 0
-        for col in range(9):
-            for row in range(9):
-                cell = self.matrix[row][col]
-                if cell.solved:
-                    continue
-                uncertainty += len(cell.options)
-        return uncertainty
+        """ total options left on unsolved cells, kept up to date as they go """
+        return self.uncertainty
 
     def show_known(self, max_options=1):
+        topo = self.topo
+        sep = '' if topo.size < 10 else ','
+        vals = [sep.join(str(x) for x in cell.options) if len(cell.options) <= max_options
+                else '' for cell in self.cells]
+        width = max([5] + [len(v) for v in vals])
         lines = []
-        row_fmt = "|{}{}{}|{}{}{}|{}{}{}|"
-        for row in range(9):
-            cells = [self.matrix[row][col] for col in range(9)]
-            uses = [len(cell.options) <= max_options for cell in cells]
-            vals = [''.join(str(x) for x in cell.options) if use else '' for cell, use in zip(cells, uses)]
-            txt = ['{:^5}'.format(v) for v in vals]
+        row_fmt = ('|' + '{}'*topo.box)*topo.box + '|'
+        for row in range(topo.size):
+            txt = ['{:^{}}'.format(v, width) for v in vals[row*topo.size:(row + 1)*topo.size]]
             #log.debug("vals is {}".format(vals))
             lines.append(row_fmt.format(*txt))
-            if row % 3 == 0:
+            if row % topo.box == 0:
                 lw = len(lines[-1])
                 lines.insert(-1, '-'*lw)
         lines.append('-'*lw)
         print('\n' + '\n'.join(lines))
 
     def export(self):
-        return [[c.solved if c.solved else 0 for c in row] for row in self.matrix]
-
-    def update(self, row, col, val):
-        """ clear val from row, col and quadrant """
-        cell = self.matrix[row][col]
-        log.debug("setting {} to {} from {} options".format(cell.ndx, val, cell.options))
-        log.debug("Clearing {} from row {}".format(val, row))
-        for j in range(9):
-            if j == col:
-                continue
-            #log.debug("Clearing {} from {}, {}".format(val, row, j))
-            self.matrix[row][j].remove(val)
-
-        log.debug("Clearing {} from col {}".format(val, col))
-        for i in range(9):
-            if i == row:
-                continue
-            #log.debug("Clearing {} from {}, {}".format(val, i, col))
-            self.matrix[i][col].remove(val)
-
-        box_row, box_col = row // 3, col // 3
-        log.debug("Clearing {} from {} box".format(val, _BOX_LABELS[box_row][box_col]))
-        for i in range(3*box_row, 3*box_row + 3):
-            for j in range(3*box_col, 3*box_col + 3):
-                if i == row and j == col:
+        size = self.topo.size
+        return [self.values[row*size:row*size + size] for row in range(size)]
+
+    def assign(self, pos, val):
+        """ solve pos as val and propagate, False on a contradiction """
+        solved = self.values[pos]
+        if solved:
+            if solved != val:
+                log.info("%s solved value %s is not %s",
+                    self.topo.ndx[pos], solved, val)
+                return False
+            return True
+        mask = self.masks[pos]
+        topo = self.topo
+        if not mask & _bit(val):
+            log.info("%s not an option: %s", val, topo.mask_values[mask])
+            return False
+        log.debug("Setting %s = %s -> SOLVED", self.topo.ndx[pos], val)
+        if self.trail is not None:
+            self.trail.append((pos, mask))
+        self.uncertainty -= topo.popcount[mask]
+        self.placed += 1
+        self.removed += topo.popcount[mask] - 1
+        self.changed |= topo.unit_bits[pos]
+        self.masks[pos] = _bit(val)
+        self.values[pos] = val
+        self.queue.append(pos)
+        return self.propagate()
+
+    def eliminate(self, pos, val):
+        """ remove val from the options of pos and propagate, False on a
+            contradiction (val was all pos had left)
+        """
+        bit = _bit(val)
+        mask = self.masks[pos]
+        if not mask & bit:
+            return True
+        if self.values[pos]:
+            log.info("%s can't remove %s, last option", self.topo.ndx[pos], val)
+            return False
+        if self.trail is not None:
+            self.trail.append((pos, mask))
+        mask ^= bit
+        self.masks[pos] = mask
+        self.uncertainty -= 1
+        self.removed += 1
+        self.changed |= self.topo.unit_bits[pos]
+        if not mask & (mask - 1):
+            val = mask.bit_length()
+            log.info("Found %s = %s, no other options", self.topo.ndx[pos], val)
+            self.values[pos] = val
+            self.uncertainty -= 1
+            self.placed += 1
+            self.queue.append(pos)
+        return self.propagate()
+
+    def propagate(self):
+        """ clear the value of each queued cell from its row, col and box
+            peers, queueing any peer left with one option
+
+            unsolved cells always keep two or more options, so the only
+            contradiction is a peer already solved to the same value
+        """
+        queue, masks, values, trail = self.queue, self.masks, self.values, self.trail
+        peers, unit_bits = self.topo.peers, self.topo.unit_bits
+        uncertainty, changed = self.uncertainty, self.changed
+        start, placed = uncertainty, 0
+        ok = True
+        while queue and ok:
+            pos = queue.popleft()
+            bit = masks[pos]
+            for p in peers[pos]:
+                mask = masks[p]
+                if not mask & bit:
                     continue
-                #log.debug("Clearing {} from {}, {}".format(val, i, j))
-                self.matrix[i][j].remove(val)
-
-        log.debug("Setting value {} on cell {}".format(val, cell.ndx))
-        cell.set(val)
+                if values[p]:
+                    log.info("%s and %s are both %s",
+                        self.topo.ndx[pos], self.topo.ndx[p], values[p])
+                    ok = False
+                    break
+                if trail is not None:
+                    trail.append((p, mask))
+                mask ^= bit
+                masks[p] = mask
+                uncertainty -= 1
+                changed |= unit_bits[p]
+                if not mask & (mask - 1):
+                    values[p] = mask.bit_length()
+                    uncertainty -= 1
+                    placed += 1
+                    queue.append(p)
+        if not ok:
+            queue.clear()
+        self.uncertainty, self.changed = uncertainty, changed
+        # each elimination took one off uncertainty, each placement one more
+        self.placed += placed
+        self.removed += start - uncertainty - placed
+        return ok
+
+    def take_dirty(self, technique):
+        """ units changed since technique last asked, as a bit mask over the
+            unit numbers
+
+            the technique is expected to look at all of them, so they are
+            marked clean for it
+        """
+        changed = self.changed
+        if changed:
+            self.changed = 0
+            dirty = self.dirty
+            for name in dirty:
+                dirty[name] |= changed
+        # a technique registered after the board was made hasn't looked yet
+        units = self.dirty.setdefault(technique, self.topo.all_units)
+        self.dirty[technique] = 0
+        return units
 
     def yield_rows(self):
-        for row in range(9):
-            cells = [self.matrix[row][col] for col in range(9)]
-            #log.debug("testing row {}".format(row))
-            yield cells
+        for unit in self.topo.rows:
+            yield [self.cells[p] for p in unit]
 
     def yield_cols(self):
-        for col in range(9):
-            cells = [self.matrix[row][col] for row in range(9)]
-            #log.debug("testing col {}".format(col))
-            yield cells
+        for unit in self.topo.cols:
+            yield [self.cells[p] for p in unit]
 
     def yield_boxes(self, rowwise=False):
-        for box_row in range(3):
-            for box_col in range(3):
-                cells = []
-                if rowwise:
-                    for j in range(3*box_col, 3*box_col + 3):
-                        for i in range(3*box_row, 3*box_row + 3):
-                            cells.append(self.matrix[i][j])
-                else:
-                    for i in range(3*box_row, 3*box_row + 3):
-                        for j in range(3*box_col, 3*box_col + 3):
-                            cells.append(self.matrix[i][j])
-                log.debug("testing {} box".format(_BOX_LABELS[box_row][box_col]))
-                yield cells
-
+        topo = self.topo
+        for box, unit in enumerate(topo.boxes):
+            if rowwise:
+                unit = tuple(p for k in range(topo.box) for p in unit[k::topo.box])
+            log.debug("testing %s box", topo.box_label(box))
+            yield [self.cells[p] for p in unit]
+
+    @_instrumented
     def direct_elim(self):
-        """ check when a number can't fit anywhere else in a row, col or box """
-        def unique_check(cells):
-            for val in range(1, 10):
-                ndx_list = [c for c in cells if c.has(val)]
-                if len(ndx_list) == 1:
-                    cell, = ndx_list
-                    if cell.solved:
-                        continue
-                    log.info("{} only fits at {}".format(val, cell.ndx))
-                    cell.set(val)
-
-        uncertainty = self.get_uncertainty()
-        keep_going = True
-        while keep_going:
-            for row in self.yield_rows():
-                unique_check(row)
-
-            for col in self.yield_cols():
-                unique_check(col)
-
-            for box in self.yield_boxes():
-                unique_check(box)
-
-            # NOTE: it doesn't seem that these tests have different results
-            # from one another
-            new_uncertainty = self.get_uncertainty()
-            if new_uncertainty < uncertainty:
-                log.info("Uncertainty from {} to {}".format(uncertainty, new_uncertainty))
-                uncertainty = new_uncertainty
-            else:
-                log.info("No uncertainty reduction, quitting at {}".format(uncertainty))
-                keep_going = False
-
-    def close_sets(self):
+        """ check when a number can't fit anywhere else in a row, col or box,
+            rechecking only units that changed since the last look
+
+            returns False on a contradiction, including a number with no
+            place left in a unit
+        """
+        masks, values = self.masks, self.values
+        topo = self.topo
+        ndx = topo.ndx
+        all_options, mask_values = topo.all_options, topo.mask_values
+        def unique_check(unit):
+            once = twice = 0
+            for p in unit:
+                m = masks[p]
+                twice |= once & m
+                once |= m
+            if once != all_options:
+                log.debug("no place for %s in unit %s",
+                    mask_values[all_options & ~once], unit)
+                return False
+            for val in mask_values[once & ~twice]:
+                bit = _bit(val)
+                for p in unit:
+                    if masks[p] & bit:
+                        break
+                else:
+                    continue    # an earlier set removed the only spot
+                if values[p]:
+                    continue
+                log.info("%s only fits at %s", val, ndx[p])
+                if not self.assign(p, val):
+                    return False
+            return True
+
+        dirty = self.take_dirty("direct_elim")
+        while dirty:
+            for unit in _units_in(dirty):
+                if not unique_check(topo.units[unit]):
+                    return False
+            dirty = self.take_dirty("direct_elim")
+        log.info("Uncertainty at %s", self.get_uncertainty())
+        return True
+
+    @_instrumented
+    def close_sets(self, max_size=None):
         """ set group of x options in x locations indicates these x numbers
             can only occur in these x locations -- so they can should be removed
             from the options list outside of the specific locations where they
@@ -176,61 +560,87 @@ class Board(object):
         """ when two boxes of a row or column are known, this forces whatever fills
             the remainder of the row or column to exist as is and it excludes these
             numbers from being anywhere other than this particular row or col
+
+            both sides are searched up to max_size (MAX_SUBSET by default):
+            naked groups of cells whose options cover only x numbers, and
+            hidden groups of numbers that fit in only x cells.  A naked group
+            of x cells in a unit of n unknowns is a hidden group of n - x, so
+            on 9x9 a max_size of 4 finds every group the full search would;
+            on bigger boards the groups stay capped, keeping the search
+            polynomial in the unit size
+
+            returns False on a contradiction
         """
-        def check_for_pairs(cells):
-            unknowns = sum(1 for c in cells if not c.solved)
-            log.debug(" {} unknowns in this group".format(unknowns))
-            for group_size in range(2, unknowns):
-                """ this is only useful when there are unknowns to potentially remove """
-                #log.debug(" checking groups of {}".format(group_size))
-                groups = [c.options for c in cells if not c.solved and len(c.options) <= group_size]
-                #log.debug(" groups are {}".format(groups))
-                vals = set()
-                for g in groups:
-                    vals.update(g)
-
-                if len(groups) < group_size:
+        masks, values = self.masks, self.values
+        topo = self.topo
+        mask_values, popcount = topo.mask_values, topo.popcount
+        if max_size is None:
+            max_size = self.MAX_SUBSET
+
+        def check_for_groups(unit):
+            open_cells = [i for i, p in enumerate(unit) if not values[p]]
+            unknowns = len(open_cells)
+            log.debug(" %s unknowns in this group", unknowns)
+            limit = min(max_size, unknowns - 1)
+            if limit < 2:
+                return True
+
+            """ naked: cells (keyed by unit index) whose options cover x numbers """
+            cells = [(1 << i, masks[unit[i]]) for i in open_cells
+                    if popcount[masks[unit[i]]] <= limit]
+            for group, vals in _closed_groups(cells, limit, popcount):
+                if vals is None:
+                    return False
+                extra = [unit[i] for i in open_cells
+                        if not group & (1 << i) and masks[unit[i]] & vals]
+                if not extra:
                     continue
-                for template in itertools.combinations(vals, group_size):
-                    matched = 0
-                    for g in groups:
-                        #log.debug("  testing if {} is contained in {}".format(g, template))
-                        if set(g).issubset(template):
-                            matched += 1
-                            #log.debug("  matches increased to {}".format(matched))
-                    if matched == group_size:
-                        """ we have a winner - the items in this group
-                            can be eliminated from all other cells
-                        """
-                        log.info("matched group {} found".format(
-                            ''.join(str(x) for x in template)))
-                        for c in cells:
-                            if c.solved or set(c.options).issubset(template):
-                                continue
-                            for val in template:
-                                c.remove(val)
-
-        uncertainty = self.get_uncertainty()
-        keep_going = True
-        while keep_going:
-            for row in self.yield_rows():
-                check_for_pairs(row)
-
-            for col in self.yield_cols():
-                c = log.debug("Checking: {}".format(','.join(c.ndx for c in col)))
-                check_for_pairs(col)
-
-            for box in self.yield_boxes():
-                check_for_pairs(box)
-
-            new_uncertainty = self.get_uncertainty()
-            if new_uncertainty < uncertainty:
-                log.info("Uncertainty from {} to {}".format(uncertainty, new_uncertainty))
-                uncertainty = new_uncertainty
-            else:
-                log.info("No uncertainty reduction, quitting at {}".format(uncertainty))
-                keep_going = False
-
+                log.info("matched group %s found", mask_values[vals])
+                for p in extra:
+                    for val in mask_values[masks[p] & vals]:
+                        if not self.eliminate(p, val):
+                            return False
+                return True     # unit is dirty again, look at it fresh
+
+            """ hidden: numbers that only fit in x of the cells, a number with
+                one place is the n - 1 naked group of the other cells
+            """
+            places = [0] * topo.size
+            for i in open_cells:
+                for val in mask_values[masks[unit[i]]]:
+                    places[val - 1] |= 1 << i
+            numbers = [(1 << n, where) for n, where in enumerate(places)
+                    if where and popcount[where] <= limit]
+            for group, spots in _closed_groups(numbers, limit, popcount):
+                if spots is None:
+                    return False
+                extra = [unit[i] for i in open_cells
+                        if spots & (1 << i) and masks[unit[i]] & ~group]
+                if not extra:
+                    continue
+                log.info("hidden group %s found", mask_values[group])
+                for p in extra:
+                    for val in mask_values[masks[p] & ~group]:
+                        if not self.eliminate(p, val):
+                            return False
+                return True
+            return True
+
+        """ stop at the first unit that gives anything, handing the units
+            not yet looked at back, so cheaper techniques go first again
+        """
+        dirty = self.take_dirty("close_sets")
+        for unit in _units_in(dirty):
+            before = self.uncertainty
+            if not check_for_groups(topo.units[unit]):
+                return False
+            if self.uncertainty < before:
+                self.dirty["close_sets"] |= dirty >> (unit + 1) << (unit + 1)
+                break
+        log.info("Uncertainty at %s", self.get_uncertainty())
+        return True
+
+    @_instrumented
     def box_sets(self):
         """ check within a box if there is only one row / col where a number
             can occur and remove number from that row / col in adjoining boxes
@@ -247,166 +657,1038 @@ class Board(object):
             consider when you have a total # of remaining variables & remaining
             spots spread through multiple rows / col / boxes, if you can
             determine which variable must go in a certain spot
-        """
-        _COL_BOX_NAMES = ["top", "center", "bottom"]
-        _ROW_BOX_NAMES = ["left", "middle", "right"]
 
+            returns False on a contradiction
+        """
+        masks, values = self.masks, self.values
+        topo = self.topo
+        mask_values = topo.mask_values
 
-        def find_limited_blocks(cells):
-            """ find values that must be located in a group of three within
-                a row / col / box list of 9 values
-                yield the group index where value must reside and the value
+        def limited(segment, rest):
+            """ values that sit in segment but nowhere in rest, skipping
+                values already solved within the segment
             """
-            groups = [cells[i*3:i*3+3] for i in range(3)]
-            group_options = [set() for _ in range(3)]
-            for options, group in zip(group_options, groups):
-                for cell in group:
-                    options.update(cell.options)
-
-            solved = [c.solved for c in cells if c.solved]
-            for val in range(1, 10):
-                if val in solved:
-                    continue
-                for this in range(3):
-                    others = [x for x in range(3) if x != this]
-                    if not any(val in group_options[n] for n in others):
-                        log.info("{} must be in set {}".format(val, this))
-                        yield (this, val)
-
-
-        for row, cells in enumerate(self.yield_rows()):
-            for block, val in find_limited_blocks(cells):
-                log.info("Row {}, {} must be in box {}".format(row, val, block))
-                """ remove val from other rows in this block """
-                for i in range((row//3)*3, (row//3)*3 + 3):
-                    if row == i:
+            seg_options = rest_options = solved = 0
+            for p in segment:
+                seg_options |= masks[p]
+                if values[p]:
+                    solved |= masks[p]
+            for p in rest:
+                rest_options |= masks[p]
+            return mask_values[seg_options & ~(rest_options | solved)]
+
+        def clear(val, positions):
+            for p in positions:
+                if not self.eliminate(p, val):
+                    return False
+            return True
+
+        dirty = self.take_dirty("box_sets")
+        while dirty:
+            for name, table in (("Row", topo.row_box), ("Col", topo.col_box)):
+                for line, block, segment, line_rest, box_rest, units in table:
+                    if not units & dirty:
+                        continue
+                    for val in limited(segment, line_rest):
+                        """ remove val from the other lines in this block """
+                        log.info("%s %s, %s must be in box %s", name, line, val, block)
+                        if not clear(val, box_rest):
+                            return False
+
+                    for val in limited(segment, box_rest):
+                        """ only line in the box for a value, remove from rest of line """
+                        log.debug("%s %s, box %s is the only place for %s",
+                            name, line, block, val)
+                        if not clear(val, line_rest):
+                            return False
+            dirty = self.take_dirty("box_sets")
+
+        log.info("Uncertainty at %s", self.get_uncertainty())
+        return True
+
+    def _digit_places(self):
+        """ per digit position masks: places[digit - 1][unit] has bit i set
+            when the digit is an option for unsolved cell i of the unit
+
+            the table is kept on the board and only the units changed since
+            the last call are redone, like a technique's dirty units
+        """
+        masks, values = self.masks, self.values
+        topo = self.topo
+        mask_values = topo.mask_values
+        units = self.take_dirty("_digit_places")
+        places = self._places
+        if places is None:
+            places = self._places = [[0] * len(topo.units) for _ in range(topo.size)]
+            units = topo.all_units
+        for u in _units_in(units):
+            for where in places:
+                where[u] = 0
+            for i, p in enumerate(topo.units[u]):
+                if not values[p]:
+                    for val in mask_values[masks[p]]:
+                        places[val - 1][u] |= 1 << i
+        return places
+
+    def _eliminate_all(self, val, positions):
+        for p in positions:
+            if not self.eliminate(p, val):
+                return False
+        return True
+
+    @_instrumented
+    def fish(self, max_size=3):
+        """ X-Wing (2 lines) and Swordfish (3): when a number's places in n
+            rows all sit in the same n cols, those rows take it in those
+            cols, so it can't be anywhere else in the cols; the same with
+            rows and cols swapped
+
+            found with a group search over the per digit row / col masks,
+            so a digit costs about as much as a close_sets unit.  Only the
+            fish with a base line among the dirty units can be new, and it
+            stops at the first pattern that removes something, handing its
+            dirty units back
+
+            returns False on a contradiction
+        """
+        dirty = self.take_dirty("fish")
+        if not dirty or not self.uncertainty:
+            return True
+        masks = self.masks
+        topo = self.topo
+        size, units, popcount = topo.size, topo.units, topo.popcount
+        places = self._digit_places()
+        for name, base, cover in (("rows", 0, size), ("cols", size, 0)):
+            changed = dirty >> base & ((1 << size) - 1)
+            if not changed:
+                continue
+            for digit in range(size):
+                bit = 1 << digit
+                lines = [(1 << n, places[digit][base + n]) for n in range(size)
+                        if 2 <= popcount[places[digit][base + n]] <= max_size]
+                for group, spots in _closed_groups(lines, max_size, popcount):
+                    if spots is None:
+                        return False
+                    if not group & changed:
                         continue
-                    for col in range(block*3, block*3 + 3):
-                        self.matrix[i][col].remove(val)
-
-        for col, cells in enumerate(self.yield_cols()):
-            for block, val in find_limited_blocks(cells):
-                log.info("Col {}, {} must be in box {}".format(col, val, block))
-                """ remove val from other cols in this block """
-                for j in range((col//3)*3, (col//3)*3 + 3):
-                    if col == j:
+                    extra = [unit[i] for k in topo.mask_values[spots]
+                            for unit in (units[cover + k - 1],)
+                            for i in range(size) if not group >> i & 1 and masks[unit[i]] & bit]
+                    if not extra:
+                        continue
+                    log.info("%s fish on %s %s", digit + 1, name, topo.mask_values[group])
+                    self.dirty["fish"] |= dirty
+                    return self._eliminate_all(digit + 1, extra)
+        return True
+
+    @_instrumented
+    def xy_wing(self):
+        """ a pivot cell with options xy seeing a pincer with xz and one
+            with yz: whichever value the pivot takes, one pincer is z, so z
+            goes from every cell seeing both pincers
+
+            a new wing needs a change to the pivot or a pincer, which share
+            a unit, so only pivots in the dirty units are tried
+
+            returns False on a contradiction
+        """
+        dirty = self.take_dirty("xy_wing")
+        if not dirty or not self.uncertainty:
+            return True
+        masks, values = self.masks, self.values
+        topo = self.topo
+        popcount, peer_sets = topo.popcount, topo.peer_sets
+        if dirty == topo.all_units:
+            pivots = topo.cells
+        else:
+            pivots = sorted({p for u in _units_in(dirty) for p in topo.units[u]})
+        for pivot in pivots:
+            pm = masks[pivot]
+            if values[pivot] or popcount[pm] != 2:
+                continue
+            wings = [p for p in topo.peers[pivot] if not values[p]
+                    and popcount[masks[p]] == 2 and popcount[masks[p] & pm] == 1]
+            for n, a in enumerate(wings):
+                for b in wings[n + 1:]:
+                    ma, mb = masks[a], masks[b]
+                    z = ma & ~pm
+                    if ma & pm == mb & pm or z != mb & ~pm:
                         continue
-                    for row in range(block*3, block*3 + 3):
-                        self.matrix[row][j].remove(val)
-
-
-        # FIXME : try doing the same thing, but yielding column wise
-        # instead of row-wise
-        for box_row in range(3):
-            for box_col in range(3):
-                solved = []
-                box_row_options = [set() for x in range(3)]   # fill with all options from row
-                box_col_options = [set() for x in range(3)]
-                for i in range(3*box_row, 3*box_row + 3):
-                    for j in range(3*box_col, 3*box_col + 3):
-                        cell = self.matrix[i][j]
-                        box_row_options[i-3*box_row].update(cell.options)
-                        box_col_options[j-3*box_col].update(cell.options)
-                        if cell.solved:
-                            solved.append(cell.solved)
-                log.debug("box {}, {} row options: {}".format(box_row, box_col, box_row_options))
-                log.debug("box {}, {} col options: {}".format(box_row, box_col, box_col_options))
-                for val in range(1, 10):
-                    if val in solved:
+                    targets = [p for p in peer_sets[a] & peer_sets[b] if masks[p] & z]
+                    if not targets:
                         continue
-                    for this in range(3):
-                        others = [x for x in range(3) if x != this]
-# NOTE : this should only check the larger numbers? because order isn't important?
-                        if not any(val in box_row_options[n] for n in others):
-                            """ only row for a value, remove from rest of row """
-                            row = this + box_row * 3
-                            log.debug("Row {}, {} box is the only place for {}".format(
-                                row, _ROW_BOX_NAMES[box_col], val))
-                            for col in range(9):
-                                if col // 3 == box_col:
-                                    """ don't remove value from this box """
-                                    continue
-                                self.matrix[row][col].remove(val)
-                        if not any(val in box_col_options[n] for n in others):
-                            """ only col for a value, remove from rest of col """
-                            col = this + box_col * 3
-                            log.debug("Col {}, {} box is the only place for {}".format(
-                                col, _COL_BOX_NAMES[box_row], val))
-                            for row in range(9):
-                                if row // 3 == box_row:
-                                    """ don't remove value from this box """
-                                    continue
-                                self.matrix[row][col].remove(val)
-
-        log.info("Uncertainty at {}".format(self.get_uncertainty()))
-
-    def solve(self):
-        uncertainty = self.get_uncertainty()
-        keep_going = True
-        while keep_going:
-            self.direct_elim()
-            self.close_sets()
-            self.box_sets()
-
-            new_uncertainty = self.get_uncertainty()
-            if new_uncertainty < uncertainty:
-                log.info("Uncertainty from {} to {}".format(uncertainty, new_uncertainty))
-                uncertainty = new_uncertainty
-            else:
-                log.info("No uncertainty reduction, quitting at {}".format(uncertainty))
-                keep_going = False
-        self.show_known(5)
+                    log.info("xy wing at %s on %s and %s", topo.ndx[pivot],
+                        topo.ndx[a], topo.ndx[b])
+                    self.dirty["xy_wing"] |= dirty
+                    return self._eliminate_all(z.bit_length(), targets)
+        return True
+
+    @_instrumented
+    def coloring(self):
+        """ single digit chains: where a number has just two places in a
+            unit, one of them holds it.  Following those pairs colors each
+            chain two ways, one color all true and the other all false, so
+                - two cells of one color in a unit make that color false
+                - a cell seeing both colors can't hold the number
+
+            returns False on a contradiction
+        """
+        if not self.take_dirty("coloring") or not self.uncertainty:
+            return True
+        masks, values = self.masks, self.values
+        topo = self.topo
+        peer_sets, mask_values = topo.peer_sets, topo.mask_values
+        places = self._digit_places()
+        for digit in range(topo.size):
+            bit = 1 << digit
+            links = collections.defaultdict(list)
+            for u, unit in enumerate(topo.units):
+                where = places[digit][u]
+                if topo.popcount[where] == 2:
+                    a, b = (unit[v - 1] for v in mask_values[where])
+                    links[a].append(b)
+                    links[b].append(a)
+
+            color = {}
+            for start in links:
+                if start in color:
+                    continue
+                sides = ([], [])
+                color[start] = 0
+                stack = [start]
+                while stack:
+                    p = stack.pop()
+                    sides[color[p]].append(p)
+                    for q in links[p]:
+                        if q not in color:
+                            color[q] = 1 - color[p]
+                            stack.append(q)
+
+                for side in sides:
+                    seen = set()
+                    for p in side:
+                        if seen.intersection(topo.units_of[p]):
+                            log.info("%s chain from %s contradicts itself",
+                                digit + 1, topo.ndx[start])
+                            return self._eliminate_all(digit + 1, side)
+                        seen.update(topo.units_of[p])
+
+                chain = set(sides[0]).union(sides[1])
+                sees = [set().union(*(peer_sets[p] for p in side)) for side in sides]
+                targets = [p for p in sees[0] & sees[1]
+                        if p not in chain and not values[p] and masks[p] & bit]
+                if targets:
+                    log.info("%s chain from %s sees %s cells both ways",
+                        digit + 1, topo.ndx[start], len(targets))
+                    return self._eliminate_all(digit + 1, targets)
+        return True
+
+    def steps(self, max_cost=None):
+        """ run the rule techniques up to max_cost (MAX_COST by default)
+            one call at a time, yielding (name, ok) after each, cheapest
+            first and back to the cheapest after any progress.  Ends when
+            none of them gets anywhere, or after the first not ok, which
+            is a contradiction
+        """
+        techniques = self.TECHNIQUES
+        if max_cost is None:
+            max_cost = self.MAX_COST
+        order = sorted((name for name, cost in techniques.items() if cost <= max_cost),
+                key=techniques.get)
+        n = 0
+        while n < len(order):
+            before = self.uncertainty
+            ok = getattr(self, order[n])()
+            yield order[n], ok
+            if not ok:
+                return
+            n = 0 if self.uncertainty < before else n + 1
+
+    def solve(self, show=True, search=False, max_steps=None, max_seconds=None,
+            max_cost=None):
+        """ run the rule techniques up to max_cost (MAX_COST by default)
+            cheapest first, going back to the cheapest after any of them
+            makes progress, until none has dirty units left or a budget
+            runs out
+
+            max_steps caps technique calls, max_seconds sets self.deadline,
+            which also stops a later search.  With search=True a stall (or
+            spent budget) cuts over to search() and the result is whether
+            that solved the grid; otherwise the result is False only for a
+            contradiction
+        """
+        if max_seconds is not None:
+            self.deadline = time.perf_counter() + max_seconds
+        steps = self.steps(max_cost)
+        taken = 0
+        while True:
+            # budgets are checked before each call, so max_steps=0 runs none
+            if max_steps is not None and taken >= max_steps:
+                log.info("Out of steps at %s", self.get_uncertainty())
+                break
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                log.info("Out of time at %s", self.get_uncertainty())
+                break
+            step = next(steps, None)
+            if step is None:
+                log.info("No dirty units left, quitting at %s", self.get_uncertainty())
+                break
+            if not step[1]:
+                log.info("Contradiction at uncertainty %s", self.get_uncertainty())
+                return False
+            taken += 1
+        if show:
+            self.show_known(5)
+        if search and self.uncertainty:
+            return self.search()
+        return True
+
+    @_instrumented
+    def search(self, rng=None):
+        """ depth first search for a complete grid, like sudoku.m but
+            propagating at every node, branching on the cell with the fewest
+            options and undoing through a trail instead of copying the board
+
+            rng (a random.Random) shuffles the order values are tried in.
+            Past self.deadline every branch fails, so the search gives up.
+            A trail the caller already keeps is extended, so the caller can
+            undo the search along with its own changes
+
+            returns True when solved, nodes / backtracks are left on the board
+        """
+        self.nodes = self.backtracks = 0
+        own_trail = self.trail is None
+        if own_trail:
+            self.trail = []
+        try:
+            solved = self._search(rng)
+        finally:
+            if own_trail:
+                self.trail = None
+        log.info("Search %s after %s nodes, %s backtracks",
+            "solved" if solved else "failed", self.nodes, self.backtracks)
+        if self.instruments is not None:
+            self.instruments.count("search", nodes=self.nodes, backtracks=self.backtracks)
+        return solved
+
+    def _search(self, rng=None):
+        self.nodes += 1
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return False
+        if not self.direct_elim():
+            return False
+        if self.uncertainty == 0:
+            return True
+
+        pos = self._branch_cell()
+        mark = (len(self.trail), self.uncertainty)
+        vals = self.topo.mask_values[self.masks[pos]]
+        if rng is not None:
+            vals = rng.sample(vals, len(vals))
+        for val in vals:
+            log.debug("Trying %s = %s", self.topo.ndx[pos], val)
+            if self.assign(pos, val) and self._search(rng):
+                return True
+            self.backtracks += 1
+            self.undo(mark)
+        return False
+
+    def _branch_cell(self):
+        """ the unsolved cell with the fewest options """
+        masks, values = self.masks, self.values
+        topo = self.topo
+        popcount = topo.popcount
+        pos, fewest = None, topo.size + 1
+        for p in topo.cells:
+            if not values[p] and popcount[masks[p]] < fewest:
+                pos, fewest = p, popcount[masks[p]]
+                if fewest == 2:
+                    break
+        return pos
+
+    def solutions(self, rng=None):
+        """ yield every complete grid the search can reach, as export()
+            lists, one at a time so the caller can stop whenever it likes
+
+            rng shuffles the value order as in search().  Past
+            self.deadline the enumeration just stops, so a caller with a
+            deadline has to check it before trusting the count.  The board
+            is rolled back to where it started once the generator finishes
+            or is closed
+        """
+        self.nodes = self.backtracks = 0
+        own_trail = self.trail is None
+        if own_trail:
+            self.trail = []
+        mark = (len(self.trail), self.uncertainty)
+        try:
+            yield from self._solutions(rng)
+        finally:
+            self.undo(mark)
+            if own_trail:
+                self.trail = None
+            log.info("Enumerated %s nodes, %s backtracks", self.nodes, self.backtracks)
+
+    def _solutions(self, rng=None):
+        self.nodes += 1
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return
+        if not self.direct_elim():
+            return
+        if self.uncertainty == 0:
+            yield self.export()
+            return
+
+        pos = self._branch_cell()
+        mark = (len(self.trail), self.uncertainty)
+        vals = self.topo.mask_values[self.masks[pos]]
+        if rng is not None:
+            vals = rng.sample(vals, len(vals))
+        for val in vals:
+            log.debug("Trying %s = %s", self.topo.ndx[pos], val)
+            if self.assign(pos, val):
+                yield from self._solutions(rng)
+            self.backtracks += 1
+            self.undo(mark)
+
+    def undo(self, mark):
+        """ roll the trail back to a (length, uncertainty) mark """
+        length, self.uncertainty = mark
+        trail, masks, values = self.trail, self.masks, self.values
+        unit_bits = self.topo.unit_bits
+        changed = self.changed
+        while len(trail) > length:
+            pos, mask = trail.pop()
+            masks[pos] = mask
+            values[pos] = 0
+            changed |= unit_bits[pos]
+        self.changed = changed
 
 
 
 class Cell(object):
-    def __init__(self, row, col):
-        self.ndx = "{},{}".format(row, col)
-        #log.debug("initializing {}".format(self.ndx))
-        self.solved = False
-        self.options = [i + 1 for i in range(9)]
-        self.notify_cb = None
+    """ view onto one position of a Board's candidate masks """
+    __slots__ = ('board', 'pos', 'ndx')
+
+    def __init__(self, row, col, board):
+        self.board = board
+        self.pos = row*board.topo.size + col
+        self.ndx = board.topo.ndx[self.pos]
 
     def __repr__(self):
         if self.solved:
             return "Cell({})={}".format(self.ndx, self.solved)
         return "Cell({})".format(self.ndx)
 
+    @property
+    def solved(self):
+        return self.board.values[self.pos] or False
+
+    @property
+    def options(self):
+        return self.board.topo.mask_values[self.board.masks[self.pos]]
+
     def set(self, val):
-        if self.solved:
-            log.info("{} is already solved: {}".format(self.ndx, self.solved))
-            log.info('{} options are {}'.format(self.ndx, self.options))
-            if self.solved != val:
-                raise ValueError("{} solved value {} is not {}".format(
-                    self.ndx, self.solved, val))
-            return
-        log.debug("Setting {} = {} -> SOLVED".format(self.ndx, val))
-        if val not in self.options:
-            raise ValueError("{} not an option: {}".format(val, self.options))
-        self.options = [val]
-        self.solved = val
-        if self.notify_cb is not None:
-            #log.debug("Running notify callback for {} = {}".format(self.ndx, val))
-            self.notify_cb(val)
+        if not self.board.assign(self.pos, val):
+            raise ValueError("{} can't be set to {}".format(self.ndx, val))
 
     def remove(self, val):
-        if val == self.solved:
-            msg = "{} can't remove {}, last option".format(self.ndx, val)
-            log.error(msg)
-            raise ValueError(msg)
-        if val in self.options:
-            self.options.remove(val)
-            if len(self.options) == 1:
-                val = self.options[0]
-                log.info("Found {} = {}, no other options".format(self.ndx, val))
-                self.set(val)
+        if not self.board.eliminate(self.pos, val):
+            raise ValueError("{} can't remove {}".format(self.ndx, val))
 
     def has(self, val):
-        return val in self.options
+        return bool(self.board.masks[self.pos] & _bit(val))
+
+
+class ExactCover(object):
+    """ Algorithm X over dancing links
+
+        the grid is an exact cover problem: for 9x9, 729 candidate rows (a
+        value in a cell), each covering 4 of 324 constraint columns (the
+        cell is filled, and the value appears once in its row, col and
+        box), size**3 rows and 4*size**2 columns in general.  The links are
+        kept in flat lists indexed by node number: node 0 is the root, then
+        the column headers, then 4 nodes per candidate row
+    """
+    _templates = {}     # box size -> links, built once and copied per grid
+
+    def __init__(self, init):
+        topo = self.topo = topology_of(init)
+        size = topo.size
+        template = ExactCover._templates.get(topo.box)
+        if template is None:
+            template = ExactCover._templates[topo.box] = self._build(topo)
+        L, R, U, D, S, self.col_of, self.row_of, self.first = template
+        self.L, self.R, self.U, self.D, self.S = L[:], R[:], U[:], D[:], S[:]
+        self.solution = []
+        self.nodes = self.backtracks = 0
+        self.deadline = None    # perf_counter() time the search gives up at
+        self.consistent = True
+        covered = set()
+        for pos in topo.cells:
+            val = init[pos // size][pos % size]
+            if val == 0:
+                continue
+            if not 0 < val <= size:
+                log.info("Given %s at %s,%s out of range", val, pos // size, pos % size)
+                self.consistent = False
+                return
+            node = self.first[pos*size + val - 1]
+            cols = [self.col_of[n] for n in (node, node + 1, node + 2, node + 3)]
+            if covered.intersection(cols):
+                log.info("Given %s at %s,%s conflicts", val, pos // size, pos % size)
+                self.consistent = False
+                return
+            covered.update(cols)
+            for c in cols:
+                self.cover(c)
+            self.solution.append(node)
+
+    @staticmethod
+    def _build(topo):
+        size, count = topo.size, topo.count
+        columns = 4*count
+        L = [c - 1 for c in range(columns + 1)]
+        R = [c + 1 for c in range(columns + 1)]
+        L[0], R[columns] = columns, 0
+        U = list(range(columns + 1))
+        D = list(range(columns + 1))
+        S = [0] * (columns + 1)
+        col_of = list(range(columns + 1))
+        row_of = [-1] * (columns + 1)
+        first = []
+        for pos in topo.cells:
+            row, col, box = topo.units_of[pos]
+            col -= size
+            box -= 2*size
+            for d in range(size):
+                node = len(col_of)
+                first.append(node)
+                targets = (1 + pos, 1 + count + row*size + d,
+                        1 + 2*count + col*size + d, 1 + 3*count + box*size + d)
+                for k, c in enumerate(targets):
+                    n = node + k
+                    L.append(node + (k - 1) % 4)
+                    R.append(node + (k + 1) % 4)
+                    U.append(U[c])
+                    D.append(c)
+                    D[U[c]] = n
+                    U[c] = n
+                    S[c] += 1
+                    col_of.append(c)
+                    row_of.append(pos*size + d)
+        return L, R, U, D, S, col_of, row_of, first
+
+    def cover(self, c):
+        L, R, U, D, S, col_of = self.L, self.R, self.U, self.D, self.S, self.col_of
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                U[D[j]] = U[j]
+                D[U[j]] = D[j]
+                S[col_of[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        L, R, U, D, S, col_of = self.L, self.R, self.U, self.D, self.S, self.col_of
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[col_of[j]] += 1
+                U[D[j]] = j
+                D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[c]] = c
+        L[R[c]] = c
+
+    def search(self):
+        """ returns True once every column is covered """
+        if not self.consistent:
+            return False
+        return self._search()
+
+    def _search(self):
+        self.nodes += 1
+        R, D, S, col_of = self.R, self.D, self.S, self.col_of
+        if R[0] == 0:
+            return True
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return False
+        c, fewest = 0, self.topo.size + 1
+        j = R[0]
+        while j != 0:
+            if S[j] < fewest:
+                c, fewest = j, S[j]
+                if fewest < 2:
+                    break
+            j = R[j]
+        if fewest == 0:
+            return False
+
+        self.cover(c)
+        r = D[c]
+        while r != c:
+            self.solution.append(r)
+            j = R[r]
+            while j != r:
+                self.cover(col_of[j])
+                j = R[j]
+            if self._search():
+                return True
+            self.backtracks += 1
+            self.solution.pop()
+            j = self.L[r]
+            while j != r:
+                self.uncover(col_of[j])
+                j = self.L[j]
+            r = D[r]
+        self.uncover(c)
+        return False
 
-    def set_notification(self, fcn):
-        self.notify_cb = fcn
+    def export(self):
+        size = self.topo.size
+        values = [0] * self.topo.count
+        for node in self.solution:
+            pos, d = divmod(self.row_of[node], size)
+            values[pos] = d + 1
+        return [values[row*size:row*size + size] for row in range(size)]
+
+
+class Result(object):
+    """ what solve() hands back, grid is in Board.export() form """
+    __slots__ = ('engine', 'grid', 'solved', 'nodes', 'backtracks',
+            'start_uncertainty', 'final_uncertainty', 'stats')
+
+    def __init__(self, engine, grid, solved, nodes=0, backtracks=0,
+            start_uncertainty=None, final_uncertainty=None, stats=None):
+        self.engine = engine
+        self.grid = grid
+        self.solved = solved
+        self.nodes = nodes
+        self.backtracks = backtracks
+        self.start_uncertainty = start_uncertainty
+        self.final_uncertainty = final_uncertainty
+        self.stats = stats      # Instruments.as_dict() when instrumented
 
+    def __repr__(self):
+        return "Result({}, solved={}, nodes={}, backtracks={})".format(
+            self.engine, self.solved, self.nodes, self.backtracks)
+
+
+def _solve_board(grid, instruments=None, max_steps=None, max_seconds=None,
+        max_cost=None, engine="board"):
+    stats = instruments.as_dict if instruments is not None else lambda: None
+    try:
+        b = Board(grid, instruments)
+    except ValueError as e:
+        log.info("Inconsistent puzzle: %s", e)
+        return Result(engine, grid, False, stats=stats())
+    start = b.get_uncertainty()
+    if not b.solve(show=False, max_steps=max_steps, max_seconds=max_seconds,
+            max_cost=max_cost):
+        return Result(engine, b.export(), False, start_uncertainty=start,
+                stats=stats())
+    final = b.get_uncertainty()
+    solved = b.search()
+    return Result(engine, b.export(), solved, b.nodes, b.backtracks, start, final,
+            stats())
+
+
+def _solve_dlx(grid, instruments=None, max_steps=None, max_seconds=None):
+    """ max_steps counts technique calls, dlx has none to count """
+    started = time.perf_counter()
+    ec = ExactCover(grid)
+    if max_seconds is not None:
+        ec.deadline = started + max_seconds
+    solved = ec.search()
+    if instruments is None:
+        return Result("dlx", ec.export(), solved, ec.nodes, ec.backtracks)
+    instruments.count("search", passes=1, seconds=time.perf_counter() - started,
+            nodes=ec.nodes, backtracks=ec.backtracks)
+    return Result("dlx", ec.export(), solved, ec.nodes, ec.backtracks,
+            stats=instruments.as_dict())
+
+
+ENGINES = {
+        "board": _solve_board,  # rule techniques, then propagating search
+        # every technique, fish / wings / chains too, then search
+        "logic": functools.partial(_solve_board, max_cost=math.inf, engine="logic"),
+        "dlx": _solve_dlx,      # exact cover, Algorithm X
+        }
+
+
+def solve(grid, engine="board", instrument=False, max_steps=None, max_seconds=None):
+    """ solve a 9x9 (or 16x16, 25x25, ...) list of lists (0 for blanks)
+        with the named engine, with instrument=True the Result carries per
+        technique stats
+
+        max_steps caps the rule technique calls, max_seconds the whole
+        solve; a puzzle out of budget comes back unsolved
+    """
+    try:
+        fcn = ENGINES[engine]
+    except KeyError:
+        raise ValueError("unknown engine {}, pick from {}".format(
+            engine, ', '.join(sorted(ENGINES))))
+    return fcn(grid, Instruments() if instrument else None, max_steps, max_seconds)
+
+
+def iter_solutions(grid):
+    """ yield the solutions of grid lazily, none for a contradictory one
+
+        the rule techniques run first and only remove options no solution
+        uses, then the propagating search walks every branch
+    """
+    try:
+        b = Board(grid)
+    except ValueError as e:
+        log.info("Inconsistent puzzle: %s", e)
+        return
+    if not b.solve(show=False):
+        return
+    yield from b.solutions()
+
+
+def count_solutions(grid, limit=2):
+    """ number of solutions of grid, counting stops at limit so the default
+        answers 0, 1 or 2 (= several) for about the cost of one solve
+    """
+    solutions = iter_solutions(grid)
+    try:
+        return sum(1 for _ in itertools.islice(solutions, limit))
+    finally:
+        solutions.close()
+
+
+class Stats(object):
+    """ running totals over a stream of Results, constant memory """
+    def __init__(self):
+        self.puzzles = self.solved = 0
+        self.nodes = self.backtracks = 0
+        self.rated = 0      # results that carry uncertainties
+        self.start_uncertainty = self.final_uncertainty = 0
+        self.techniques = {}    # summed Result.stats
+
+    def add(self, result):
+        self.puzzles += 1
+        self.solved += bool(result.solved)
+        self.nodes += result.nodes
+        self.backtracks += result.backtracks
+        if result.final_uncertainty is not None:
+            self.rated += 1
+            self.start_uncertainty += result.start_uncertainty
+            self.final_uncertainty += result.final_uncertainty
+        if result.stats:
+            for name, amounts in result.stats.items():
+                self.techniques.setdefault(name, collections.Counter()).update(amounts)
+
+    def as_dict(self):
+        """ totals and per technique counters, ready for json """
+        return {
+            "puzzles": self.puzzles,
+            "solved": self.solved,
+            "nodes": self.nodes,
+            "backtracks": self.backtracks,
+            "start_uncertainty": self.start_uncertainty,
+            "final_uncertainty": self.final_uncertainty,
+            "rated": self.rated,
+            "techniques": {name: dict(totals)
+                for name, totals in self.techniques.items()},
+            }
+
+    def log(self):
+        if self.rated:
+            log.info("Average Starting Uncertainty: %5.1f",
+                self.start_uncertainty/self.rated)
+            log.info("Average Final Uncertainty   : %5.1f",
+                self.final_uncertainty/self.rated)
+        if self.puzzles:
+            log.info("Average Search Nodes        : %5.1f",
+                self.nodes/self.puzzles)
+            log.info("Solved %s of %s", self.solved, self.puzzles)
+
+
+def _solve_chunk(chunk, engine, instrument=False):
+    return [solve(grid, engine, instrument) for grid in chunk]
+
+
+def solve_many(puzzles, engine="board", workers=None, chunksize=64,
+        ordered=True, stats=None, instrument=False):
+    """ solve an iterable of puzzles over a process pool
+
+        yields (index, Result) pairs as chunks finish, in input order or,
+        with ordered=False, in completion order.  Only 2 chunks per worker
+        are ever pulled from puzzles, so a generator is consumed lazily.
+        Totals go into stats (a Stats) and are logged when the stream ends
+    """
+    if stats is None:
+        stats = Stats()
+    workers = workers or os.cpu_count() or 1
+    puzzles = iter(puzzles)
+    chunks = iter(lambda: list(itertools.islice(puzzles, chunksize)), [])
+    try:
+        if workers == 1:
+            index = 0
+            for chunk in chunks:
+                for result in _solve_chunk(chunk, engine, instrument):
+                    stats.add(result)
+                    yield index, result
+                    index += 1
+            return
+
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+        try:
+            pending = collections.OrderedDict()     # future -> first index
+            submitted = 0
+            def submit():
+                nonlocal submitted
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending[pool.submit(_solve_chunk, chunk, engine, instrument)] = submitted
+                    submitted += len(chunk)
+
+            for _ in range(2*workers):
+                submit()
+            while pending:
+                if ordered:
+                    done = [next(iter(pending))]
+                else:
+                    done, _ = concurrent.futures.wait(pending,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    first = pending.pop(future)
+                    results = future.result()
+                    submit()
+                    for k, result in enumerate(results):
+                        stats.add(result)
+                        yield first + k, result
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        stats.log()
+
+
+def _batch_others(c, per_unit):
+    """ for each (board, row, col, digit) count how many *other* cells of
+        the row, col and box hold per_unit, returned as three arrays
+    """
+    import numpy as np
+    n = c.shape[0]
+    per_unit = per_unit.astype(np.int8)
+    row = per_unit.sum(2, keepdims=True) - per_unit
+    col = per_unit.sum(1, keepdims=True) - per_unit
+    boxed = per_unit.reshape(n, 3, 3, 3, 3, 9)
+    box = (boxed.sum((2, 4), keepdims=True) - boxed).reshape(n, 9, 9, 9)
+    return row, col, box
+
+
+def _batch_line_box(c):
+    """ box / line eliminations along rows, the box_sets logic
+        c is (n, 9, 9, 9), returns the candidates to drop
+    """
+    import numpy as np
+    n = c.shape[0]
+    seg = c.reshape(n, 3, 3, 3, 3, 9).any(4)    # n, band, row in band, stack, digit
+    seg8 = seg.astype(np.int8)
+    # pointing: the digit sits on one row of the box, drop it from that row
+    pointing = seg & (seg8.sum(2, keepdims=True) == 1)
+    pointing8 = pointing.astype(np.int8)
+    drop_row = (pointing8.sum(3, keepdims=True) - pointing8) > 0
+    # claiming: the digit sits in one box of the row, drop it from the box
+    claiming = seg & (seg8.sum(3, keepdims=True) == 1)
+    claiming8 = claiming.astype(np.int8)
+    drop_box = (claiming8.sum(2, keepdims=True) - claiming8) > 0
+    drop = (drop_row | drop_box)[:, :, :, :, None, :]
+    return np.broadcast_to(drop, (n, 3, 3, 3, 3, 9)).reshape(n, 9, 9, 9)
+
+
+def _batch_round(c):
+    """ one pass of naked singles, hidden singles and box / line reductions """
+    import numpy as np
+    single = c.sum(-1) == 1
+    for others in _batch_others(c, c & single[..., None]):
+        c &= others == 0
+
+    hidden = np.zeros_like(c)
+    for others in _batch_others(c, c):
+        hidden |= c & (others == 0)
+    c = np.where(hidden.any(-1, keepdims=True), hidden, c)
+
+    c &= ~_batch_line_box(c)
+    c &= ~_batch_line_box(c.transpose(0, 2, 1, 3)).transpose(0, 2, 1, 3)
+    return c
+
+
+def solve_batch(puzzles, fallback="dlx", chunksize=4096):
+    """ solve an (N, 9, 9) array of puzzles (0 for blanks) together
+
+        candidates are an (N, 9, 9, 9) boolean tensor and every rule pass
+        runs on all boards of a chunk at once; boards that propagation
+        leaves open are finished one at a time by the fallback engine
+
+        returns (grids, solved), an (N, 9, 9) array and an (N,) bool array.
+        An unsolved board (fallback=None, or the fallback failed) comes back
+        with the cells propagation fixed, givens included; an inconsistent
+        one comes back as its puzzle
+    """
+    import numpy as np
+    puzzles = np.asarray(puzzles, dtype=np.int8).reshape(-1, 9, 9)
+    grids = np.zeros_like(puzzles)
+    solved = np.zeros(len(puzzles), dtype=bool)
+    digits = np.arange(1, 10, dtype=np.int8)
+    for start in range(0, len(puzzles), chunksize):
+        chunk = puzzles[start:start + chunksize]
+        cand = (chunk[..., None] == 0) | (chunk[..., None] == digits)
+        active = np.arange(len(chunk))
+        totals = cand.sum((1, 2, 3))
+        while len(active):
+            c = _batch_round(cand[active])
+            cand[active] = c
+            new_totals = c.sum((1, 2, 3))
+            moving = new_totals < totals[active]
+            totals[active] = new_totals
+            active = active[moving]
+
+        counts = cand.sum(-1)
+        dead = (counts == 0).any((1, 2))
+        for unit_axes in ((2,), (1,)):
+            dead |= ~cand.any(unit_axes).all((1, 2))
+        dead |= ~cand.reshape(-1, 3, 3, 3, 3, 9).any((2, 4)).all((1, 2, 3))
+        done = ~dead & (counts == 1).all((1, 2))
+        known = np.where(counts == 1, cand.argmax(-1) + 1, 0).astype(np.int8)
+        grids[start:start + len(chunk)] = np.where(dead[:, None, None], chunk, known)
+        solved[start:start + len(chunk)] = done
+
+        open_boards = np.flatnonzero(~dead & ~done)
+        log.info("Batch of %s: %s solved, %s inconsistent, %s to %s",
+            len(chunk), done.sum(), dead.sum(), len(open_boards), fallback)
+        if fallback is None:
+            continue
+        for i in open_boards:
+            result = solve(known[i].tolist(), fallback)
+            if result.solved:
+                grids[start + i] = result.grid
+                solved[start + i] = True
+    return grids, solved
+
+
+""" puzzle text format: one puzzle per line, 81 characters in reading
+    order with '.' or '0' for blanks, blank lines and '#' comments skipped
+"""
+_BLANKS = bytes.maketrans(b'.', b'0')
+
+
+def parse_line(line):
+    """ grid from one 81 character line (bytes or str), None to skip it """
+    if isinstance(line, str):
+        line = line.encode('ascii')
+    line = line.strip()
+    if not line or line.startswith(b'#'):
+        return None
+    line = line.translate(_BLANKS)
+    if len(line) != 81 or line.translate(None, b'0123456789'):
+        raise ValueError("not an 81 character puzzle: {!r}".format(line[:90]))
+    vals = [b - 48 for b in line]
+    return [vals[row*9:row*9 + 9] for row in range(9)]
+
+
+def format_grid(grid):
+    """ 81 character line for a grid, '.' for blanks """
+    return ''.join(str(v) if v else '.' for row in grid for v in row)
+
+
+def _lines(path, use_mmap=False, bufsize=1 << 20):
+    if path == '-':
+        yield from sys.stdin.buffer
+        return
+    with open(path, 'rb', buffering=bufsize) as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from iter(mm.readline, b'')
+        else:
+            yield from f
+
+
+def read_puzzles(paths, use_mmap=False):
+    """ stream grids from files ('-' for stdin), skipping bad lines """
+    for path in paths:
+        for n, line in enumerate(_lines(path, use_mmap), 1):
+            try:
+                grid = parse_line(line)
+            except ValueError as e:
+                log.warning("%s:%s %s", path, n, e)
+                continue
+            if grid is not None:
+                yield grid
+
+
+def write_results(results, out, batch=1024):
+    """ write solved grids from (index, Result) pairs, batch lines per write
+
+        an unsolved result is written as '-', so line i still goes with
+        puzzle i
+    """
+    lines = []
+    for _, result in results:
+        if result.solved:
+            lines.append(format_grid(result.grid).encode('ascii') + b'\n')
+        else:
+            lines.append(b'-\n')
+        if len(lines) >= batch:
+            out.write(b''.join(lines))
+            lines = []
+    out.write(b''.join(lines))
+    out.flush()
+
+
+def make_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description="Solve sudoku puzzles given "
+            "one per line as 81 characters ('.' or '0' for blanks), writing "
+            "the solutions in the same format")
+    parser.add_argument('files', nargs='+',
+            help="puzzle files, '-' for stdin")
+    parser.add_argument('-o', '--output', default='-',
+            help="solution file, '-' for stdout")
+    parser.add_argument('-e', '--engine', default='board', choices=sorted(ENGINES))
+    parser.add_argument('-j', '--workers', type=int, default=1,
+            help="solver processes, 0 for one per cpu")
+    parser.add_argument('--chunksize', type=int, default=64)
+    parser.add_argument('--mmap', action='store_true',
+            help="memory map input files instead of reading them")
+    parser.add_argument('--stats', metavar='FILE',
+            help="count and time each technique, writing the totals as json "
+            "to FILE ('-' for stderr)")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG if args.verbose > 1 else logging.INFO)
+    stats = Stats()
+    results = solve_many(read_puzzles(args.files, args.mmap), args.engine,
+            args.workers, args.chunksize, stats=stats,
+            instrument=args.stats is not None)
+    if args.output == '-':
+        write_results(results, sys.stdout.buffer)
+    else:
+        with open(args.output, 'wb') as out:
+            write_results(results, out)
+    if args.stats == '-':
+        json.dump(stats.as_dict(), sys.stderr, indent=2, sort_keys=True)
+        sys.stderr.write('\n')
+    elif args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump(stats.as_dict(), f, indent=2, sort_keys=True)
+    return 0 if stats.solved == stats.puzzles else 1
 
 
 
@@ -416,20 +1698,14 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
     # from http://www.forbeginners.info/sudoku-puzzles/
 
-    def run_all(puzzles):
-        initial_unc = []
+    def run_all(puzzles, engine="board", workers=1):
         uncertainties = []
         boards = []
-        for p in puzzles:
-            b = Board(p)
-            initial_unc.append(b.get_uncertainty())
-            b.solve()
-            uncertainties.append(b.get_uncertainty())
-            boards.append(b.export())
-        avg_unc_begin = sum(initial_unc)/len(initial_unc)
-        avg_unc = sum(uncertainties)/len(uncertainties)
-        log.info("Average Starting Uncertainty: {:5.1f}".format(avg_unc_begin))
-        log.info("Average Final Uncertainty   : {:5.1f}".format(avg_unc))
+        for i, result in solve_many(puzzles, engine, workers):
+            if not result.solved:
+                log.warning("No solution for puzzle %s", i)
+            uncertainties.append(result.final_uncertainty)
+            boards.append(result.grid)
         return boards, uncertainties
 
     puzzle = [
@@ -576,6 +1852,9 @@ if __name__ == "__main__":
             [9, 3, 0,  0, 2, 6,  0, 0, 0]],
            ]
 
+    # with no arguments run the demo puzzles, stdin takes an explicit '-'
+    if len(sys.argv) > 1:
+        sys.exit(main())
 
     boards, uncertainties = run_all(puzzle)
     b, *_  = boards
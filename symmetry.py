@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+"""
+Sudoku symmetries and a solution cache built on them
+
+Relabelling the digits, shuffling rows within a band, shuffling the bands,
+the same for columns / stacks, and transposing all map a puzzle to an
+equivalent one whose solution maps the same way.  canonicalize() picks one
+representative per family so a cache keyed on it answers every member.
+
+A transform is (transpose, rows, cols, digits): the grid is transposed
+first if asked, then out[i][j] = digits[grid[rows[i]][cols[j]]], where
+digits[0] is 0 so blanks stay blank.
+"""
+
+import dbm
+import logging
+import itertools
+import collections
+
+import sudoku
+
+log = logging.getLogger(__name__)
+
+
+def transform_grid(grid, transform):
+    transpose, rows, cols, digits = transform
+    if transpose:
+        grid = list(zip(*grid))
+    return [[digits[grid[r][c]] for c in cols] for r in rows]
+
+
+def untransform_grid(grid, transform):
+    """ undo transform_grid, e.g. to bring a canonical solution home """
+    transpose, rows, cols, digits = transform
+    inverse = [0] * 10
+    for d, label in enumerate(digits):
+        inverse[label] = d
+    out = [[0] * 9 for _ in range(9)]
+    for i, r in enumerate(rows):
+        for j, c in enumerate(cols):
+            out[r][c] = inverse[grid[i][j]]
+    if transpose:
+        out = [list(col) for col in zip(*out)]
+    return out
+
+
+def _line_keys(grid):
+    """ relabel and shuffle invariant keys for each row and each col:
+        clue count, then the (clue count of the crossing line, how often
+        the digit appears) pairs of its clues
+    """
+    digit_count = collections.Counter(v for row in grid for v in row if v)
+    row_count = [sum(1 for v in row if v) for row in grid]
+    col_count = [sum(1 for row in grid if row[c]) for c in range(9)]
+    row_keys = [(row_count[r], tuple(sorted((col_count[c], digit_count[grid[r][c]])
+                for c in range(9) if grid[r][c]))) for r in range(9)]
+    col_keys = [(col_count[c], tuple(sorted((row_count[r], digit_count[grid[r][c]])
+                for r in range(9) if grid[r][c]))) for c in range(9)]
+    return row_keys, col_keys
+
+
+def _tied_orders(items, key):
+    """ every ordering of items sorted by key, ties permuted every way """
+    ordered = sorted(items, key=key)
+    groups = [list(g) for _, g in itertools.groupby(ordered, key=key)]
+    for choice in itertools.product(*(itertools.permutations(g) for g in groups)):
+        yield [item for group in choice for item in group]
+
+
+def _line_orders(keys):
+    """ line orders that keep bands together, bands and the lines within
+        them sorted by key with ties tried every way
+    """
+    band_key = lambda band: sorted(keys[band*3 + i] for i in range(3))
+    per_band = [list(_tied_orders([band*3 + i for i in range(3)], keys.__getitem__))
+            for band in range(3)]
+    for bands in _tied_orders(range(3), band_key):
+        for lines in itertools.product(*(per_band[band] for band in bands)):
+            yield [line for group in lines for line in group]
+
+
+def _relabel(grid, rows, cols):
+    """ digits numbered by first appearance in reading order, absent
+        digits after them in their own order
+    """
+    digits = [0] * 10
+    label = 0
+    for r in rows:
+        for c in cols:
+            v = grid[r][c]
+            if v and not digits[v]:
+                label += 1
+                digits[v] = label
+    for v in range(1, 10):
+        if not digits[v]:
+            label += 1
+            digits[v] = label
+    return digits
+
+
+def canonicalize(grid, max_candidates=4096):
+    """ map grid to the representative of its symmetry family
+
+        returns (canonical grid, transform) with
+        transform_grid(grid, transform) == canonical.  Rows and cols are
+        ordered by invariant keys and only ties are searched, taking the
+        smallest result; past max_candidates orderings the search stops,
+        which keeps the answer correct but may miss a cache hit
+    """
+    best = best_transform = None
+    tried = 0
+    for transpose in (False, True):
+        g = [list(col) for col in zip(*grid)] if transpose else grid
+        row_keys, col_keys = _line_keys(g)
+        col_orders = list(itertools.islice(_line_orders(col_keys), max_candidates))
+        for rows in _line_orders(row_keys):
+            for cols in col_orders:
+                digits = _relabel(g, rows, cols)
+                flat = tuple(digits[g[r][c]] for r in rows for c in cols)
+                if best is None or flat < best:
+                    best, best_transform = flat, (transpose, rows, cols, digits)
+                tried += 1
+                if tried >= max_candidates:
+                    break
+            if tried >= max_candidates:
+                log.debug("canonicalize stopped after %s candidates", tried)
+                break
+    return [list(best[r*9:r*9 + 9]) for r in range(9)], best_transform
+
+
+class SolutionCache(object):
+    """ LRU of solutions keyed on canonical puzzles, optionally backed by
+        a dbm file that outlives the process
+
+        solve() answers any puzzle whose family has been solved before by
+        mapping the stored canonical solution back, and solves (and
+        stores) the canonical puzzle otherwise
+    """
+    def __init__(self, maxsize=10000, path=None, engine="board"):
+        self.maxsize = maxsize
+        self.engine = engine
+        self.entries = collections.OrderedDict()
+        self.store = dbm.open(path, 'c') if path else None
+        self.hits = self.misses = 0
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _lookup(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.store is not None and key in self.store:
+            value = self.store[key]
+            self._remember(key, value)
+            return value
+        return None
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def solve(self, grid):
+        """ Result for grid, engine "cache" when it came from the cache """
+        canonical, transform = canonicalize(grid)
+        key = sudoku.format_grid(canonical).encode('ascii')
+        value = self._lookup(key)
+        if value is not None:
+            self.hits += 1
+            if not value:
+                return sudoku.Result("cache", grid, False)
+            solution = sudoku.parse_line(value)
+            return sudoku.Result("cache", untransform_grid(solution, transform), True)
+
+        self.misses += 1
+        result = sudoku.solve(canonical, self.engine)
+        value = sudoku.format_grid(result.grid).encode('ascii') if result.solved else b''
+        self._remember(key, value)
+        if self.store is not None:
+            self.store[key] = value
+        result.grid = untransform_grid(result.grid, transform)
+        return result
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+""" checks for Board, run with python -m pytest (or python -m unittest) """
+
+import unittest
+
+import sudoku
+
+EASY = sudoku.parse_line(
+    "2...1..5.3.5.42....18..9..2.321..8....1.2.3....9..326.1..7..98....26.5.7.6..8...3")
+
+
+class BoardTest(unittest.TestCase):
+
+    def test_register_after_board_made(self):
+        """ a board made before a technique is registered still schedules it """
+        class Registered(sudoku.Board):
+            pass
+        board = Registered(EASY)
+        seen = []
+        def noop(board):
+            seen.append(board.take_dirty("noop"))
+            return True
+        Registered.register(noop, 1.5)
+        self.assertTrue(board.solve(show=False, max_cost=2))
+        self.assertEqual(seen[0], board.topo.all_units)
+        self.assertNotIn("noop", sudoku.Board.TECHNIQUES)
+
+    def test_max_steps(self):
+        """ the step budget is checked before a technique runs """
+        board = sudoku.Board(EASY)
+        before = board.uncertainty
+        self.assertTrue(board.solve(show=False, max_steps=0))
+        self.assertEqual(board.uncertainty, before)
+        self.assertTrue(board.solve(show=False, max_steps=1))
+        self.assertLess(board.uncertainty, before)
+
+
+if __name__ == "__main__":
+    unittest.main()